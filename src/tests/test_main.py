@@ -2,18 +2,28 @@
 # https://github.com/craigahobbs/unittest-parallel/blob/main/LICENSE
 
 from io import StringIO
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
 import re
 import sys
+import tempfile
+import threading
+import time
 import unittest
+import warnings
 from unittest.mock import ANY, Mock, call, patch
 
 import unittest_parallel.__main__
+import unittest_parallel.main
 from unittest_parallel.main import main
 
 
 class MockMultiprocessingPool:
-    def __init__(self, count, **kwargs):
-        pass
+    def __init__(self, count, initializer=None, initargs=(), **kwargs):
+        if initializer is not None:
+            initializer(*initargs)
 
     def __enter__(self):
         return self
@@ -22,8 +32,21 @@ class MockMultiprocessingPool:
         pass
 
     @staticmethod
-    def map(func, args):
-        return [func(arg) for arg in args]
+    def imap_unordered(func, args, chunksize=1):
+        for arg in args:
+            yield func(arg)
+
+    @staticmethod
+    def starmap(func, args, chunksize=1):
+        return [func(*arg) for arg in args]
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def join():
+        # Simulate test process exit
+        unittest_parallel.main._exit_worker() # pylint: disable=protected-access
 
 
 class MockMultiprocessingContext:
@@ -35,29 +58,53 @@ class MockMultiprocessingContext:
         return MockMultiprocessingPool(count, **kwargs)
 
     # pylint: disable-next=invalid-name
-    def Manager(self):
-        return MockMultiprocessingManager()
+    def Pipe(self):
+        return multiprocessing.Pipe()
+
+    # pylint: disable-next=invalid-name
+    def Process(self, target, args, daemon=None):
+        return MockMultiprocessingProcess(target, args)
 
+    # pylint: disable-next=invalid-name
+    def RawValue(self, typecode, value):
+        return MockMultiprocessingValue(value)
 
-class MockMultiprocessingManagerEvent:
-    def __init__(self):
-        self._value = False
+    # pylint: disable-next=invalid-name
+    def Value(self, typecode, value):
+        return MockMultiprocessingValue(value)
 
-    def set(self):
-        self._value = True
+    def set_forkserver_preload(self, module_names):
+        pass
 
-    def is_set(self):
-        return self._value
 
+class MockMultiprocessingProcess:
+    def __init__(self, target, args):
+        # Connections are duplicated, as they would be for a child process
+        args = tuple(
+            multiprocessing.connection.Connection(os.dup(arg.fileno()))
+            if isinstance(arg, multiprocessing.connection.Connection) else arg
+            for arg in args
+        )
+        self.thread = threading.Thread(target=target, args=args)
+        self.exitcode = None
 
-class MockMultiprocessingManager:
-    def __enter__(self):
-        return self
+    def start(self):
+        self.thread.start()
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
+    def join(self):
+        self.thread.join()
+
+    def kill(self):
         pass
 
-    Event = MockMultiprocessingManagerEvent
+
+class MockMultiprocessingValue:
+    def __init__(self, value):
+        self.value = value
+        self.lock = threading.Lock()
+
+    def get_lock(self):
+        return self.lock
 
 
 class SuccessTestCase(unittest.TestCase):
@@ -94,6 +141,50 @@ class SuccessWithOutputTestCase(unittest.TestCase):
         self.assertIsNotNone(self)
 
 
+class FailureWithOutputTestCase(unittest.TestCase):
+    def mock_1(self):
+        print('Failure stdout!')
+        print('Failure stderr!', file=sys.stderr, end='')
+        self.fail()
+
+
+class HangTestCase(unittest.TestCase):
+    def mock_1(self):
+        time.sleep(0.5)
+
+
+class ClassFixtureTestCase(unittest.TestCase):
+    setup_count = 0
+
+    @classmethod
+    def setUpClass(cls):
+        cls.setup_count += 1
+
+    def mock_1(self):
+        self.assertEqual(self.setup_count, 1)
+
+    def mock_2(self):
+        self.assertEqual(self.setup_count, 1)
+
+
+class SetUpClassErrorTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        raise Exception('setUpClass error')
+
+    def mock_1(self):
+        self.assertIsNotNone(self) # pragma: no cover
+
+
+class FailfastOtherProcessTestCase(unittest.TestCase):
+    def mock_1(self):
+        # Simulate another test process failing fast
+        unittest_parallel.main._WORKER_STATE['failfast'].value = 1 # pylint: disable=protected-access
+
+    def mock_2(self):
+        self.fail() # pragma: no cover
+
+
 class FailureTestCase(unittest.TestCase):
     def mock_1(self):
         self.assertIsNotNone(self)
@@ -142,6 +233,48 @@ class ExpectedFailureTestCase(unittest.TestCase):
         self.assertIsNotNone(self)
 
 
+class SlowTestCase(unittest.TestCase):
+    def mock_1(self):
+        time.sleep(0.05)
+
+
+class SlowTestCase2(unittest.TestCase):
+    def mock_1(self):
+        time.sleep(0.05)
+
+
+class WarnsTestCase(unittest.TestCase):
+    def mock_1(self):
+        with self.assertWarns(UserWarning):
+            time.sleep(0.05)
+            warnings.warn('Warning!', UserWarning)
+
+
+class WarnsTestCase2(unittest.TestCase):
+    def mock_1(self):
+        time.sleep(0.02)
+        with self.assertWarns(UserWarning):
+            time.sleep(0.05)
+            warnings.warn('Warning!', UserWarning)
+
+
+# Test process init and finalize function calls - (function name, UNITTEST_PARALLEL_WORKER)
+WORKER_HOOK_CALLS = []
+
+
+def mock_worker_init():
+    WORKER_HOOK_CALLS.append(('init', os.environ['UNITTEST_PARALLEL_WORKER']))
+
+
+def mock_worker_finalize():
+    WORKER_HOOK_CALLS.append(('finalize', os.environ['UNITTEST_PARALLEL_WORKER']))
+
+
+def mock_worker_init_error():
+    WORKER_HOOK_CALLS.append(('init', os.environ['UNITTEST_PARALLEL_WORKER']))
+    raise RuntimeError('Init error!')
+
+
 class TestMain(unittest.TestCase):
 
     def assert_output(self, actual, expected):
@@ -273,6 +406,174 @@ Ran 5 tests in <SEC>s
 OK
 ''')
 
+    def test_start_method(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')]),
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', Mock(wraps=MockMultiprocessingContext)) as get_context_mock, \
+             patch.object(MockMultiprocessingContext, 'set_forkserver_preload') as preload_mock, \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['--start-method', 'fork'])
+
+        get_context_mock.assert_called_once_with(method='fork')
+        preload_mock.assert_not_called()
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (3 total tests) across 1 processes
+...
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK
+''')
+
+    def test_start_method_forkserver(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')]),
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', Mock(wraps=MockMultiprocessingContext)) as get_context_mock, \
+             patch.object(MockMultiprocessingContext, 'set_forkserver_preload') as preload_mock, \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['--start-method', 'forkserver'])
+
+        get_context_mock.assert_called_once_with(method='forkserver')
+        preload_mock.assert_called_once_with(['tests.test_main'])
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (3 total tests) across 1 processes
+...
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK
+''')
+
+    def test_start_method_forkserver_preload(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')]),
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', Mock(wraps=MockMultiprocessingContext)) as get_context_mock, \
+             patch.object(MockMultiprocessingContext, 'set_forkserver_preload') as preload_mock, \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['--start-method', 'forkserver', '--preload', 'json', '--preload', 'os'])
+
+        get_context_mock.assert_called_once_with(method='forkserver')
+        preload_mock.assert_called_once_with(['json', 'os'])
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (3 total tests) across 1 processes
+...
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK
+''')
+
+    def test_send_test_ids(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')]),
+                unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+            ]),
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[unittest.FunctionTestCase(lambda: None)])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)), \
+             patch('unittest.TestLoader.loadTestsFromNames', wraps=unittest.TestLoader().loadTestsFromNames) as load_mock:
+            main(['--level', 'class', '--send-test-ids'])
+
+        self.assertListEqual(load_mock.mock_calls, [
+            call(['tests.test_main.SuccessTestCase.mock_1', 'tests.test_main.SuccessTestCase.mock_2']),
+            call(['tests.test_main.SuccessTestCase2.mock_1'])
+        ])
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (4 total tests) across 1 processes
+....
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+''')
+
+    def test_dispatch_dynamic(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')]),
+            ]),
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['--dispatch', 'dynamic'])
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (4 total tests) across 2 processes
+....
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+Dynamic dispatch removed an estimated <SEC>s of process idle time
+
+OK
+''')
+
+    def test_dispatch_error_order(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[ErrorTestCase('mock_2')]),
+                unittest.TestSuite(tests=[SetUpClassErrorTestCase('mock_1')]),
+                unittest.TestSuite(tests=[FailureTestCase('mock_2')])
+            ])
+        ])
+
+        # Test suites that complete out of order are reported in test suite order
+        def imap_reversed(func, args, chunksize=1):
+            return reversed([func(arg) for arg in args])
+
+        with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.object(MockMultiprocessingPool, 'imap_unordered', staticmethod(imap_reversed)), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--level', 'class'])
+
+        self.assertEqual(cm_exc.exception.code, 3)
+        self.assertEqual(stdout.getvalue(), '')
+        error_indexes = [
+            stderr.getvalue().index('\nmock_2 (tests.test_main.ErrorTestCase'),
+            stderr.getvalue().index('\nsetUpClass (tests.test_main.SetUpClassErrorTestCase)\n'),
+            stderr.getvalue().index('\nmock_2 (tests.test_main.FailureTestCase')
+        ]
+        self.assertListEqual(error_indexes, sorted(error_indexes))
+
     def test_success_max_suites(self):
         discover_suite = unittest.TestSuite(tests=[
             unittest.TestSuite(tests=[
@@ -634,6 +935,29 @@ AssertionError: None
 Ran 2 tests in <SEC>s
 
 FAILED (failures=1)
+''')
+
+    def test_success_failfast_other_process(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[FailfastOtherProcessTestCase('mock_1'), FailfastOtherProcessTestCase('mock_2')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['-f'])
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (2 total tests) across 1 processes
+.
+----------------------------------------------------------------------
+Ran 1 test in <SEC>s
+
+OK
 ''')
 
     def test_success_buffer(self):
@@ -909,74 +1233,160 @@ Ran 3 tests in <SEC>s
 FAILED (failures=1)
 ''')
 
-    def test_error(self):
+    def test_progress(self):
         discover_suite = unittest.TestSuite(tests=[
             unittest.TestSuite(tests=[
-                unittest.TestSuite(tests=[ErrorTestCase('mock_1'), ErrorTestCase('mock_2'), ErrorTestCase('mock_3')])
+                unittest.TestSuite(tests=[FailureTestCase('mock_1'), FailureTestCase('mock_2'), FailureTestCase('mock_3')])
+            ]),
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')])
             ])
         ])
-        with patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
              patch('sys.stdout', StringIO()) as stdout, \
              patch('sys.stderr', StringIO()) as stderr, \
-             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)), \
+             patch('unittest_parallel.main.PROGRESS_INTERVAL', 0):
             with self.assertRaises(SystemExit) as cm_exc:
-                main(['-v'])
+                main(['--progress'])
 
         self.assertEqual(cm_exc.exception.code, 1)
         self.assertEqual(stdout.getvalue(), '')
+        stderr_value = re.sub(r'\d+\.\d tests/s', '<RATE> tests/s', stderr.getvalue())
         if sys.version_info < (3, 11): # pragma: no cover
-            self.assert_output(re.sub(r'File ".*?", line \d+', 'File "<FILE>", line <LINE>', stderr.getvalue()), '''\
-Running 1 test suites (3 total tests) across 1 processes
-
-mock_1 (tests.test_main.ErrorTestCase) ...
-mock_1 (tests.test_main.ErrorTestCase) ... ok
-mock_2 (tests.test_main.ErrorTestCase) ...
-mock_2 (tests.test_main.ErrorTestCase) ... ERROR
-mock_3 (tests.test_main.ErrorTestCase) ...
-mock_3 (tests.test_main.ErrorTestCase) ... ok
-
+            self.assert_output(stderr_value, '''\
+Running 2 test suites (6 total tests) across 1 processes
+.F.
 ======================================================================
-mock_2 (tests.test_main.ErrorTestCase)
+mock_2 (tests.test_main.FailureTestCase)
 ----------------------------------------------------------------------
 Traceback (most recent call last):
   File "<FILE>", line <LINE>, in mock_2
-    raise Exception()
-Exception
+    self.fail()
+AssertionError: None
+
+Progress: 3 tests (<RATE> tests/s), 1 test suites remaining, ETA <SEC>s
+...
+Progress: 6 tests (<RATE> tests/s), 0 test suites remaining, ETA <SEC>s
 
 ----------------------------------------------------------------------
-Ran 3 tests in <SEC>s
+Ran 6 tests in <SEC>s
 
-FAILED (errors=1)
+FAILED (failures=1)
 ''')
-        else: # pragma: no cover
-            self.assert_output(re.sub(r'File ".*?", line \d+', 'File "<FILE>", line <LINE>', stderr.getvalue()), '''\
-Running 1 test suites (3 total tests) across 1 processes
-
-mock_1 (tests.test_main.ErrorTestCase.mock_1) ...
-mock_1 (tests.test_main.ErrorTestCase.mock_1) ... ok
-mock_2 (tests.test_main.ErrorTestCase.mock_2) ...
-mock_2 (tests.test_main.ErrorTestCase.mock_2) ... ERROR
-mock_3 (tests.test_main.ErrorTestCase.mock_3) ...
-mock_3 (tests.test_main.ErrorTestCase.mock_3) ... ok
-
+        elif sys.version_info < (3, 13): # pragma: no cover
+            self.assert_output(stderr_value, '''\
+Running 2 test suites (6 total tests) across 1 processes
+.F.
 ======================================================================
-mock_2 (tests.test_main.ErrorTestCase.mock_2)
+mock_2 (tests.test_main.FailureTestCase.mock_2)
 ----------------------------------------------------------------------
 Traceback (most recent call last):
   File "<FILE>", line <LINE>, in mock_2
-    raise Exception()
-Exception
+    self.fail()
+AssertionError: None
+
+Progress: 3 tests (<RATE> tests/s), 1 test suites remaining, ETA <SEC>s
+...
+Progress: 6 tests (<RATE> tests/s), 0 test suites remaining, ETA <SEC>s
 
 ----------------------------------------------------------------------
-Ran 3 tests in <SEC>s
+Ran 6 tests in <SEC>s
 
-FAILED (errors=1)
+FAILED (failures=1)
 ''')
-
-    def test_skipped(self):
-        discover_suite = unittest.TestSuite(tests=[
-            unittest.TestSuite(tests=[
-                unittest.TestSuite(tests=[SkipTestCase('mock_1'), SkipTestCase('mock_2'), SkipTestCase('mock_3')])
+        else: # pragma: no cover
+            self.assert_output(stderr_value, '''\
+Running 2 test suites (6 total tests) across 1 processes
+.F.
+======================================================================
+mock_2 (tests.test_main.FailureTestCase.mock_2)
+----------------------------------------------------------------------
+Traceback (most recent call last):
+  File "<FILE>", line <LINE>, in mock_2
+    self.fail()
+    ~~~~~~~~~^^
+AssertionError: None
+
+Progress: 3 tests (<RATE> tests/s), 1 test suites remaining, ETA <SEC>s
+...
+Progress: 6 tests (<RATE> tests/s), 0 test suites remaining, ETA <SEC>s
+
+----------------------------------------------------------------------
+Ran 6 tests in <SEC>s
+
+FAILED (failures=1)
+''')
+
+    def test_error(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[ErrorTestCase('mock_1'), ErrorTestCase('mock_2'), ErrorTestCase('mock_3')])
+            ])
+        ])
+        with patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['-v'])
+
+        self.assertEqual(cm_exc.exception.code, 1)
+        self.assertEqual(stdout.getvalue(), '')
+        if sys.version_info < (3, 11): # pragma: no cover
+            self.assert_output(re.sub(r'File ".*?", line \d+', 'File "<FILE>", line <LINE>', stderr.getvalue()), '''\
+Running 1 test suites (3 total tests) across 1 processes
+
+mock_1 (tests.test_main.ErrorTestCase) ...
+mock_1 (tests.test_main.ErrorTestCase) ... ok
+mock_2 (tests.test_main.ErrorTestCase) ...
+mock_2 (tests.test_main.ErrorTestCase) ... ERROR
+mock_3 (tests.test_main.ErrorTestCase) ...
+mock_3 (tests.test_main.ErrorTestCase) ... ok
+
+======================================================================
+mock_2 (tests.test_main.ErrorTestCase)
+----------------------------------------------------------------------
+Traceback (most recent call last):
+  File "<FILE>", line <LINE>, in mock_2
+    raise Exception()
+Exception
+
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+FAILED (errors=1)
+''')
+        else: # pragma: no cover
+            self.assert_output(re.sub(r'File ".*?", line \d+', 'File "<FILE>", line <LINE>', stderr.getvalue()), '''\
+Running 1 test suites (3 total tests) across 1 processes
+
+mock_1 (tests.test_main.ErrorTestCase.mock_1) ...
+mock_1 (tests.test_main.ErrorTestCase.mock_1) ... ok
+mock_2 (tests.test_main.ErrorTestCase.mock_2) ...
+mock_2 (tests.test_main.ErrorTestCase.mock_2) ... ERROR
+mock_3 (tests.test_main.ErrorTestCase.mock_3) ...
+mock_3 (tests.test_main.ErrorTestCase.mock_3) ... ok
+
+======================================================================
+mock_2 (tests.test_main.ErrorTestCase.mock_2)
+----------------------------------------------------------------------
+Traceback (most recent call last):
+  File "<FILE>", line <LINE>, in mock_2
+    raise Exception()
+Exception
+
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+FAILED (errors=1)
+''')
+
+    def test_skipped(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SkipTestCase('mock_1'), SkipTestCase('mock_2'), SkipTestCase('mock_3')])
             ])
         ])
         with patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
@@ -1139,12 +1549,13 @@ OK
                 call().start(),
                 call().stop(),
                 call().save(),
+                call(),
                 call(branch=False, data_file=ANY, include=None, omit=[ANY], source=None),
                 call().start(),
                 call().stop(),
                 call().save(),
-                call(),
-                call().combine(data_paths=[ANY, ANY]),
+                call().combine(data_paths=[ANY]),
+                call().combine(data_paths=[ANY]),
                 call().report(ignore_errors=True, file=ANY)
             ]
         )
@@ -1183,6 +1594,53 @@ Ran 3 tests in <SEC>s
 
 OK
 
+Total coverage is 100.00%
+''')
+
+    def test_coverage_per_process(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')])
+            ]),
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+            ])
+        ])
+        with patch('coverage.Coverage') as coverage_mock, \
+             patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            coverage_instance = coverage_mock.return_value
+            coverage_instance.report.return_value = 100.
+            main(['--coverage', '--coverage-per-process'])
+
+        self.assertListEqual(
+            coverage_mock.mock_calls,
+            [
+                call(branch=False, data_file=ANY, include=None, omit=[ANY], source=None),
+                call().start(),
+                call().stop(),
+                call().save(),
+                call(),
+                call(branch=False, data_file=ANY, include=None, omit=[ANY], source=None),
+                call().start(),
+                call().stop(),
+                call().save(),
+                call().combine(data_paths=[ANY, ANY]),
+                call().report(ignore_errors=True, file=ANY)
+            ]
+        )
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (4 total tests) across 1 processes
+....
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+
 Total coverage is 100.00%
 ''')
 
@@ -1208,12 +1666,13 @@ Total coverage is 100.00%
                 call().start(),
                 call().stop(),
                 call().save(),
+                call(),
                 call(branch=True, data_file=ANY, include=None, omit=[ANY], source=None),
                 call().start(),
                 call().stop(),
                 call().save(),
-                call(),
-                call().combine(data_paths=[ANY, ANY]),
+                call().combine(data_paths=[ANY]),
+                call().combine(data_paths=[ANY]),
                 call().report(ignore_errors=True, file=ANY)
             ]
         )
@@ -1311,12 +1770,13 @@ Total coverage is 100.00%
                 call().start(),
                 call().stop(),
                 call().save(),
+                call(),
                 call(branch=True, data_file=ANY, include=None, omit=[ANY], source=None),
                 call().start(),
                 call().stop(),
                 call().save(),
-                call(),
-                call().combine(data_paths=[ANY, ANY]),
+                call().combine(data_paths=[ANY]),
+                call().combine(data_paths=[ANY]),
                 call().report(ignore_errors=True, file=ANY),
                 call().html_report(directory='html_dir', ignore_errors=True)
             ]
@@ -1381,12 +1841,13 @@ Total coverage is 100.00%
                 call().start(),
                 call().stop(),
                 call().save(),
+                call(),
                 call(branch=True, data_file=ANY, include=None, omit=[ANY], source=None),
                 call().start(),
                 call().stop(),
                 call().save(),
-                call(),
-                call().combine(data_paths=[ANY, ANY]),
+                call().combine(data_paths=[ANY]),
+                call().combine(data_paths=[ANY]),
                 call().report(ignore_errors=True, file=ANY),
                 call().xml_report(ignore_errors=True, outfile='xml_dir')
             ]
@@ -1453,12 +1914,13 @@ Total coverage is 100.00%
                 call().start(),
                 call().stop(),
                 call().save(),
+                call(),
                 call(branch=True, data_file=ANY, include=None, omit=[ANY], source=None),
                 call().start(),
                 call().stop(),
                 call().save(),
-                call(),
-                call().combine(data_paths=[ANY, ANY]),
+                call().combine(data_paths=[ANY]),
+                call().combine(data_paths=[ANY]),
                 call().report(ignore_errors=True, file=ANY)
             ]
         )
@@ -1530,13 +1992,14 @@ Total coverage is 99.00%
                 call().start(),
                 call().stop(),
                 call().save(),
+                call(config_file='rcfile'),
                 call(branch=True, config_file='rcfile', data_file=ANY, include=['include*.py'],
                      omit=['omit*.py', ANY], source=['source*.py']),
                 call().start(),
                 call().stop(),
                 call().save(),
-                call(config_file='rcfile'),
-                call().combine(data_paths=[ANY, ANY]),
+                call().combine(data_paths=[ANY]),
+                call().combine(data_paths=[ANY]),
                 call().report(ignore_errors=True, file=ANY)
             ]
         )
@@ -1578,6 +2041,1733 @@ OK
 Total coverage is 100.00%
 ''')
 
+    def test_cache_dir(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')]),
+                    unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+                ]),
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase3('mock_1')])
+                ])
+            ])
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            durations_path = os.path.join(cache_dir, 'durations.json')
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+                main(['--level', 'class', '--cache-dir', cache_dir])
+            with open(durations_path, encoding='utf-8') as durations_file:
+                durations = json.load(durations_file)
+
+            self.assertEqual(stdout.getvalue(), '')
+            self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (4 total tests) across 1 processes
+....
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+''')
+            self.assertListEqual(
+                sorted(durations.keys()),
+                [
+                    'tests.test_main.SuccessTestCase',
+                    'tests.test_main.SuccessTestCase2.mock_1',
+                    'tests.test_main.SuccessTestCase3.mock_1'
+                ]
+            )
+
+            # Run again with saved durations - the longest suites run first, unknown suites use the average duration
+            with open(durations_path, 'w', encoding='utf-8') as durations_file:
+                json.dump({'tests.test_main.SuccessTestCase': 1, 'tests.test_main.SuccessTestCase3.mock_1': 5}, durations_file)
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+                main(['-v', '--level', 'class', '--cache-dir', cache_dir])
+
+        self.assertEqual(stdout.getvalue(), '')
+        if sys.version_info < (3, 11): # pragma: no cover
+            self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (4 total tests) across 1 processes
+
+mock_1 (tests.test_main.SuccessTestCase3) ...
+mock_1 (tests.test_main.SuccessTestCase3) ... ok
+mock_1 (tests.test_main.SuccessTestCase2) ...
+mock_1 (tests.test_main.SuccessTestCase2) ... ok
+mock_1 (tests.test_main.SuccessTestCase) ...
+mock_1 (tests.test_main.SuccessTestCase) ... ok
+mock_2 (tests.test_main.SuccessTestCase) ...
+mock_2 (tests.test_main.SuccessTestCase) ... ok
+
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+''')
+        else: # pragma: no cover
+            self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (4 total tests) across 1 processes
+
+mock_1 (tests.test_main.SuccessTestCase3.mock_1) ...
+mock_1 (tests.test_main.SuccessTestCase3.mock_1) ... ok
+mock_1 (tests.test_main.SuccessTestCase2.mock_1) ...
+mock_1 (tests.test_main.SuccessTestCase2.mock_1) ... ok
+mock_1 (tests.test_main.SuccessTestCase.mock_1) ...
+mock_1 (tests.test_main.SuccessTestCase.mock_1) ... ok
+mock_2 (tests.test_main.SuccessTestCase.mock_2) ...
+mock_2 (tests.test_main.SuccessTestCase.mock_2) ... ok
+
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+''')
+
+    def test_last_failed(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')]),
+                    unittest.TestSuite(tests=[FailureTestCase('mock_1'), FailureTestCase('mock_2'), FailureTestCase('mock_3')]),
+                    unittest.TestSuite(tests=[SetUpClassErrorTestCase('mock_1')])
+                ])
+            ])
+
+        def run_tests(argv):
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(['--level', 'class', '--cache-dir', cache_dir, *argv])
+            with open(os.path.join(cache_dir, 'lastfailed.json'), encoding='utf-8') as last_failed_file:
+                last_failed = json.load(last_failed_file)
+            self.assertEqual(stdout.getvalue(), '')
+            return cm_exc.exception.code, stderr.getvalue(), last_failed
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # The failed tests are saved
+            exit_code, stderr, last_failed = run_tests([])
+            self.assertEqual(exit_code, 2)
+            self.assertTrue(stderr.startswith('Running 3 test suites (6 total tests) across 1 processes\n'))
+            self.assertDictEqual(last_failed, {
+                'tests.test_main.FailureTestCase.mock_2': True,
+                'tests.test_main.SetUpClassErrorTestCase.mock_1': True
+            })
+
+            # Run only the failed test suites
+            exit_code, stderr, last_failed = run_tests(['--last-failed'])
+            self.assertEqual(exit_code, 2)
+            self.assertTrue(stderr.startswith('''\
+2 of 3 test suites failed in the last run
+Running 2 test suites (4 total tests) across 1 processes
+'''))
+            self.assertDictEqual(last_failed, {
+                'tests.test_main.FailureTestCase.mock_2': True,
+                'tests.test_main.SetUpClassErrorTestCase.mock_1': True
+            })
+
+            # Run the failed test suites first - failed tests that are not run are kept
+            with open(os.path.join(cache_dir, 'lastfailed.json'), 'w', encoding='utf-8') as last_failed_file:
+                json.dump({
+                    'tests.test_main.FailureTestCase.mock_2': True,
+                    'tests.test_main.OtherTestCase.mock_1': True
+                }, last_failed_file)
+            report_path = os.path.join(cache_dir, 'report.json')
+            exit_code, stderr, last_failed = run_tests(['--failed-first', '--report-json', report_path])
+            with open(report_path, encoding='utf-8') as report_file:
+                report = json.load(report_file)
+            self.assertEqual(exit_code, 2)
+            self.assertEqual(len(report['tests']), 6)
+            self.assertListEqual([test['suite'] for test in report['tests'][:3]], [
+                'tests.test_main.FailureTestCase',
+                'tests.test_main.FailureTestCase',
+                'tests.test_main.FailureTestCase'
+            ])
+            self.assertDictEqual(last_failed, {
+                'tests.test_main.FailureTestCase.mock_2': True,
+                'tests.test_main.OtherTestCase.mock_1': True,
+                'tests.test_main.SetUpClassErrorTestCase.mock_1': True
+            })
+
+    def test_watch(self):
+        with tempfile.TemporaryDirectory() as start_dir:
+            os.mkdir(os.path.join(start_dir, 'watch_pkg'))
+            with open(os.path.join(start_dir, 'watch_pkg', '__init__.py'), 'w', encoding='utf-8') as module_file:
+                module_file.write('from . import other\n')
+            with open(os.path.join(start_dir, 'watch_pkg', 'other.py'), 'w', encoding='utf-8'):
+                pass
+            helper_path = os.path.join(start_dir, 'watch_pkg', 'helper.py')
+            with open(helper_path, 'w', encoding='utf-8') as module_file:
+                module_file.write('VALUE = 1\n')
+            with open(os.path.join(start_dir, 'test_watch_a.py'), 'w', encoding='utf-8') as module_file:
+                module_file.write('''\
+import unittest
+from watch_pkg import helper
+
+class WatchTestCase(unittest.TestCase):
+    def test_a(self):
+        self.assertEqual(helper.VALUE, 1)
+''')
+            with open(os.path.join(start_dir, 'test_watch_b.py'), 'w', encoding='utf-8') as module_file:
+                module_file.write('''\
+import unittest
+from watch_pkg import other
+
+class WatchTestCase(unittest.TestCase):
+    def test_b(self):
+        pass
+''')
+            os.mkdir(os.path.join(start_dir, 'venv'))
+            venv_path = os.path.join(start_dir, 'venv', 'site.py')
+            with open(venv_path, 'w', encoding='utf-8'):
+                pass
+
+            # Change the helper module (and a file in a non-package directory, which is not watched), then stop watching
+            def watch_sleep(unused_seconds):
+                if watch_sleep.call_count == 1:
+                    with open(helper_path, 'w', encoding='utf-8') as module_file:
+                        module_file.write('VALUE = 2\n')
+                    os.utime(helper_path, ns=(0, 0))
+                    os.utime(venv_path, ns=(0, 0))
+                else:
+                    raise KeyboardInterrupt()
+            watch_sleep = Mock(side_effect=watch_sleep)
+
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.path', list(sys.path)), \
+                 patch.dict('sys.modules'), \
+                 patch('time.sleep', watch_sleep), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr:
+                main(['-s', start_dir, '--watch'])
+
+        self.assertEqual(watch_sleep.call_count, 2)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertTrue(stderr.getvalue().startswith('Running 2 test suites (2 total tests) across 1 processes\n..\n'))
+        self.assertIn(f'''
+OK
+
+Watching for file changes in {start_dir!r}...
+Detected 1 changed files
+
+1 of 2 test suites affected by the changed files
+Running 1 test suites (1 total tests) across 1 processes
+F
+''', stderr.getvalue())
+        self.assertIn('\nAssertionError: 2 != 1\n', stderr.getvalue())
+        self.assertTrue(stderr.getvalue().endswith(f'''
+FAILED (failures=1)
+
+Watching for file changes in {start_dir!r}...
+'''))
+
+    def test_watch_invalid(self):
+        with patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr:
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--watch', '--start-method', 'forkserver'])
+
+        self.assertEqual(cm_exc.exception.code, 2)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertTrue(stderr.getvalue().endswith(
+            'unittest-parallel: error: --watch does not support --serve, --worker, or --start-method forkserver\n'
+        ))
+
+    def test_last_failed_no_cache_dir(self):
+        for argv in (['--failed-first'], ['--last-failed']):
+            with patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr:
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(argv)
+
+            self.assertEqual(cm_exc.exception.code, 2)
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertTrue(stderr.getvalue().endswith(
+                'unittest-parallel: error: --failed-first and --last-failed require --cache-dir\n'
+            ))
+
+    def test_cache_dir_invalid(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            durations_path = os.path.join(cache_dir, 'durations.json')
+            with open(durations_path, 'w', encoding='utf-8') as durations_file:
+                durations_file.write('invalid')
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                main(['--cache-dir', cache_dir])
+            with open(durations_path, encoding='utf-8') as durations_file:
+                durations = json.load(durations_file)
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (1 total tests) across 1 processes
+.
+----------------------------------------------------------------------
+Ran 1 test in <SEC>s
+
+OK
+''')
+        self.assertListEqual(list(durations.keys()), ['tests.test_main.SuccessTestCase.mock_1'])
+
+    def test_cache_discovery(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')]),
+                    unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+                ])
+            ])
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Discover tests and save the discovery cache
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)) as discover_mock:
+                main(['--level', 'class', '--cache-dir', cache_dir, '--cache-discovery'])
+            with open(os.path.join(cache_dir, 'discovery.json'), encoding='utf-8') as discovery_file:
+                discovery = json.load(discovery_file)
+
+            discover_mock.assert_called_once()
+            self.assertListEqual(discovery['tests'], [
+                ['tests.test_main', [['SuccessTestCase', ['mock_1', 'mock_2']], ['SuccessTestCase2', ['mock_1']]]]
+            ])
+            self.assertEqual(stdout.getvalue(), '')
+            self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (3 total tests) across 1 processes
+...
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK
+''')
+
+            # Load the tests from the discovery cache
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)) as discover_mock:
+                main(['-v', '--level', 'class', '--cache-dir', cache_dir, '--cache-discovery'])
+
+            discover_mock.assert_not_called()
+            self.assertEqual(stdout.getvalue(), '')
+            if sys.version_info < (3, 11): # pragma: no cover
+                self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (3 total tests) across 1 processes
+
+mock_1 (tests.test_main.SuccessTestCase) ...
+mock_1 (tests.test_main.SuccessTestCase) ... ok
+mock_2 (tests.test_main.SuccessTestCase) ...
+mock_2 (tests.test_main.SuccessTestCase) ... ok
+mock_1 (tests.test_main.SuccessTestCase2) ...
+mock_1 (tests.test_main.SuccessTestCase2) ... ok
+
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK
+''')
+            else: # pragma: no cover
+                self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (3 total tests) across 1 processes
+
+mock_1 (tests.test_main.SuccessTestCase.mock_1) ...
+mock_1 (tests.test_main.SuccessTestCase.mock_1) ... ok
+mock_2 (tests.test_main.SuccessTestCase.mock_2) ...
+mock_2 (tests.test_main.SuccessTestCase.mock_2) ... ok
+mock_1 (tests.test_main.SuccessTestCase2.mock_1) ...
+mock_1 (tests.test_main.SuccessTestCase2.mock_1) ... ok
+
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK
+''')
+
+            # Changed discovery arguments - discover tests
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)) as discover_mock:
+                main(['--level', 'class', '--cache-dir', cache_dir, '--cache-discovery', '-k', 'mock_1'])
+
+            discover_mock.assert_called_once()
+
+    def test_cache_discovery_not_loadable(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[unittest.FunctionTestCase(lambda: None)])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                main(['--cache-dir', cache_dir, '--cache-discovery'])
+
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, 'discovery.json')))
+            self.assertEqual(stdout.getvalue(), '')
+            self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (1 total tests) across 1 processes
+.
+----------------------------------------------------------------------
+Ran 1 test in <SEC>s
+
+OK
+''')
+
+    def test_durations(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SlowTestCase('mock_1'), SuccessTestCase('mock_2')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['--level', 'test', '--durations', '1'])
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(re.sub(r'\d+\.\d%|process \d+', '<N>', stderr.getvalue()), '''\
+Running 3 test suites (3 total tests) across 2 processes
+...
+Slowest 1 tests:
+  <SEC>s tests.test_main.SlowTestCase.mock_1
+Slowest 1 test suites:
+  <SEC>s tests.test_main.SlowTestCase.mock_1
+Test process busy time:
+  <SEC>s <N> (3 test suites)
+Process time lost to imbalance: <SEC>s (<N>)
+
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK
+''')
+
+    def test_durations_imbalance(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SlowTestCase('mock_1')]),
+                unittest.TestSuite(tests=[SlowTestCase2('mock_1')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['--level', 'class', '--durations', '0', '--max-tasks-per-worker', '1', '--max-worker-memory', '10000'])
+
+        # The test suites run concurrently, so the process slots' time lost to imbalance is less than half of the test run
+        self.assertEqual(stdout.getvalue(), '')
+        lost_match = re.search(r'\nProcess time lost to imbalance: \d+\.\d{3}s \((\d+\.\d)%\)\n', stderr.getvalue())
+        self.assertIsNotNone(lost_match)
+        self.assertLess(float(lost_match.group(1)), 50)
+
+    def test_profile(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SlowTestCase('mock_1')])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with open(os.path.join(profile_dir, 'worker-1.prof'), 'w', encoding='utf-8'):
+                pass
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                main(['--profile', profile_dir])
+
+            self.assertListEqual(sorted(os.listdir(profile_dir)), ['profile.prof', f'worker-{os.getpid()}.prof'])
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertTrue(stderr.getvalue().startswith(f'''\
+Running 1 test suites (2 total tests) across 1 processes
+..
+Merged 1 test process profiles to {os.path.join(profile_dir, 'profile.prof')!r}
+'''))
+        self.assertIn('Ordered by: cumulative time', stderr.getvalue())
+        self.assertRegex(stderr.getvalue(), r'test_main\.py:\d+\(mock_1\)')
+        self.assertRegex(stderr.getvalue(), r'\n-{70}\nRan 2 tests in \d+\.\d{3}s\n\nOK\n$')
+
+    def test_report_json(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[FailureTestCase('mock_1'), FailureTestCase('mock_2')]),
+                unittest.TestSuite(tests=[SkipTestCase('mock_2'), ExpectedFailureTestCase('mock_2')])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'report.json')
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()), \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(['--level', 'class', '--report-json', report_path])
+            with open(report_path, encoding='utf-8') as report_file:
+                report = json.load(report_file)
+
+        self.assertEqual(cm_exc.exception.code, 1)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertIsInstance(report['duration'], float)
+        self.assertListEqual(
+            [(test['id'], test['suite'], test['pid'], test['outcome'], test['message']) for test in report['tests']],
+            [
+                ('tests.test_main.FailureTestCase.mock_1', 'tests.test_main.FailureTestCase', os.getpid(), 'success', None),
+                ('tests.test_main.FailureTestCase.mock_2', 'tests.test_main.FailureTestCase', os.getpid(), 'failure', ANY),
+                ('tests.test_main.SkipTestCase.mock_2', 'tests.test_main',
+                 os.getpid(), 'skipped', 'skip reason'),
+                ('tests.test_main.ExpectedFailureTestCase.mock_2', 'tests.test_main',
+                 os.getpid(), 'expected failure', None)
+            ]
+        )
+        self.assertIn('AssertionError', report['tests'][1]['message'])
+        self.assertListEqual(
+            sorted({(type(test['start']), type(test['duration'])) for test in report['tests']}, key=str),
+            [(float, float)]
+        )
+
+    def test_junit_xml(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SkipTestCase('mock_2')])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'report.xml')
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                main(['--junit-xml', report_path])
+            with open(report_path, encoding='utf-8') as report_file:
+                report = report_file.read()
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (2 total tests) across 1 processes
+.s
+----------------------------------------------------------------------
+Ran 2 tests in <SEC>s
+
+OK (skipped=1)
+''')
+        report = re.sub(r'time="\d+\.\d{3}"', 'time="<SEC>"', report)
+        report = re.sub(r'timestamp="[^"]+"', 'timestamp="<TIME>"', report)
+        report = re.sub(r'name="pid" value="\d+"', 'name="pid" value="<PID>"', report)
+        self.assertEqual(report, '''\
+<?xml version='1.0' encoding='utf-8'?>
+<testsuites name="unittest-parallel" time="<SEC>" tests="2" failures="0" errors="0" skipped="1">
+  <testsuite name="tests.test_main" time="<SEC>" tests="2" failures="0" errors="0" skipped="1">
+    <properties>
+      <property name="pid" value="<PID>" />
+    </properties>
+    <testcase classname="tests.test_main.SuccessTestCase" name="mock_1" time="<SEC>" timestamp="<TIME>" />
+    <testcase classname="tests.test_main.SkipTestCase" name="mock_2" time="<SEC>" timestamp="<TIME>">
+      <skipped message="skip reason" />
+    </testcase>
+  </testsuite>
+</testsuites>''')
+
+    def test_parallel_discovery(self):
+        with tempfile.TemporaryDirectory() as start_dir:
+            os.mkdir(os.path.join(start_dir, 'pdpkg'))
+            with open(os.path.join(start_dir, 'pdpkg', '__init__.py'), 'w', encoding='utf-8'):
+                pass
+            for module_path, class_name in (('test_pd_one.py', 'OneTest'), (os.path.join('pdpkg', 'test_pd_two.py'), 'TwoTest')):
+                with open(os.path.join(start_dir, module_path), 'w', encoding='utf-8') as module_file:
+                    module_file.write(f"""\
+import unittest
+
+class {class_name}(unittest.TestCase):
+    def test_a(self):
+        pass
+
+    def test_b(self):
+        pass
+""")
+            with open(os.path.join(start_dir, 'helper.py'), 'w', encoding='utf-8') as module_file:
+                module_file.write('raise ImportError()\n')
+
+            with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.path', list(sys.path)), \
+                 patch.dict('sys.modules'), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover') as discover_mock:
+                main(['-s', start_dir, '--level', 'test', '--parallel-discovery'])
+
+        discover_mock.assert_not_called()
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 4 test suites (4 total tests) across 2 processes
+....
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+''')
+
+    def test_parallel_discovery_import_error(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as start_dir:
+            with open(os.path.join(start_dir, 'test_pd_error.py'), 'w', encoding='utf-8') as module_file:
+                module_file.write('raise ImportError()\n')
+
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.path', list(sys.path)), \
+                 patch.dict('sys.modules'), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)) as discover_mock:
+                main(['-s', start_dir, '--parallel-discovery'])
+
+        discover_mock.assert_called_once()
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (1 total tests) across 1 processes
+.
+----------------------------------------------------------------------
+Ran 1 test in <SEC>s
+
+OK
+''')
+
+    def test_affected_since(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')]),
+                    unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+                ]),
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase3('mock_1')])
+                ])
+            ])
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Run with coverage to save the impact data
+            with patch('coverage.Coverage') as coverage_mock, \
+                 patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+                coverage_instance = coverage_mock.return_value
+                coverage_instance.report.return_value = 100.
+                coverage_data = coverage_instance.get_data.return_value
+                coverage_data.measured_files.return_value = [os.path.abspath('module.py')]
+                coverage_data.contexts_by_lineno.return_value = {
+                    1: ['', 'tests.test_main.SuccessTestCase'],
+                    2: ['tests.test_main.SuccessTestCase', 'tests.test_main.SuccessTestCase2.mock_1']
+                }
+                main(['--level', 'class', '--coverage', '--cache-dir', cache_dir])
+            with open(os.path.join(cache_dir, 'impact.json'), encoding='utf-8') as impact_file:
+                impact = json.load(impact_file)
+
+            self.assertIn(call().switch_context('tests.test_main.SuccessTestCase'), coverage_mock.mock_calls)
+            self.assertIn(call().switch_context('tests.test_main.SuccessTestCase2.mock_1'), coverage_mock.mock_calls)
+            self.assertIn(call().switch_context('tests.test_main.SuccessTestCase3.mock_1'), coverage_mock.mock_calls)
+            self.assertDictEqual(impact, {
+                'tests.test_main.SuccessTestCase': {'module.py': [1, 2]},
+                'tests.test_main.SuccessTestCase2.mock_1': {'module.py': [2]}
+            })
+            self.assertEqual(stdout.getvalue(), '')
+            self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (4 total tests) across 1 processes
+....
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+
+Total coverage is 100.00%
+''')
+
+            # Run only the test suites affected by a changed file - test suites without impact data are always run
+            changed_path = os.path.join(cache_dir, 'changed.txt')
+            with open(changed_path, 'w', encoding='utf-8') as changed_file:
+                changed_file.write('other.py\n')
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+                main(['--level', 'class', '--cache-dir', cache_dir, '--affected-since', changed_path])
+
+            self.assertEqual(stdout.getvalue(), '')
+            self.assert_output(stderr.getvalue(), '''\
+1 of 3 test suites affected by 1 changed files
+Running 1 test suites (1 total tests) across 1 processes
+.
+----------------------------------------------------------------------
+Ran 1 test in <SEC>s
+
+OK
+''')
+
+            # Run the test suites affected by a changed file since a git ref
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('subprocess.check_output', Mock(side_effect=[os.getcwd() + '\n', 'module.py\n'])) as check_output_mock, \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+                main(['--level', 'class', '--cache-dir', cache_dir, '--affected-since', 'main'])
+
+        self.assertListEqual(check_output_mock.mock_calls, [
+            call(['git', 'rev-parse', '--show-toplevel'], text=True),
+            call(['git', 'diff', '--name-only', 'main'], text=True)
+        ])
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+3 of 3 test suites affected by 1 changed files
+Running 3 test suites (4 total tests) across 1 processes
+....
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+''')
+
+    def test_cache_discovery_no_cache_dir(self):
+        with patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr:
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--cache-discovery'])
+
+        self.assertEqual(cm_exc.exception.code, 2)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertTrue(stderr.getvalue().endswith('unittest-parallel: error: --cache-discovery requires --cache-dir\n'))
+
+    def test_affected_since_no_cache_dir(self):
+        with patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr:
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--affected-since', 'main'])
+
+        self.assertEqual(cm_exc.exception.code, 2)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertTrue(stderr.getvalue().endswith('unittest-parallel: error: --affected-since requires --cache-dir\n'))
+
+    def test_shard(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')]),
+                    unittest.TestSuite(tests=[SuccessTestCase2('mock_1')]),
+                    unittest.TestSuite(tests=[SuccessTestCase3('mock_1')])
+                ])
+            ])
+
+        # Without saved durations, shards are balanced by test count
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+            main(['--level', 'test', '--shard-index', '0', '--shard-count', '2'])
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Shard 0 of 2 shards: 3 of 5 test suites
+Running 3 test suites (3 total tests) across 1 processes
+...
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK
+''')
+
+        # With saved durations, shards are balanced by duration
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for shard_index, shard_suites in (('0', 2), ('1', 3)):
+                with open(os.path.join(cache_dir, 'durations.json'), 'w', encoding='utf-8') as durations_file:
+                    json.dump({
+                        'tests.test_main.SuccessTestCase.mock_1': 3,
+                        'tests.test_main.SuccessTestCase.mock_2': 1,
+                        'tests.test_main.SuccessTestCase.mock_3': 1,
+                        'tests.test_main.SuccessTestCase2.mock_1': 1
+                    }, durations_file)
+                with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                     patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                     patch('sys.stdout', StringIO()) as stdout, \
+                     patch('sys.stderr', StringIO()) as stderr, \
+                     patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+                    main(['--level', 'test', '--cache-dir', cache_dir, '--shard-index', shard_index, '--shard-count', '2'])
+
+                self.assertEqual(stdout.getvalue(), '')
+                self.assertTrue(stderr.getvalue().startswith(f'''\
+Shard {shard_index} of 2 shards: {shard_suites} of 5 test suites
+Running {shard_suites} test suites ({shard_suites} total tests) across 1 processes
+'''))
+
+    def test_shard_coverage(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')])
+            ])
+        ])
+        with patch('coverage.Coverage') as coverage_mock, \
+             patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            coverage_instance = coverage_mock.return_value
+            coverage_instance.report.return_value = 100.
+            main(['--coverage', '--shard-index', '0', '--shard-count', '1'])
+
+        # The shard's combined coverage data file is saved before the coverage report
+        self.assertListEqual(
+            coverage_mock.mock_calls[-4:],
+            [
+                call().combine(data_paths=[ANY]),
+                call().combine(data_paths=[ANY]),
+                call().save(),
+                call().report(ignore_errors=True, file=ANY)
+            ]
+        )
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Shard 0 of 1 shards: 1 of 1 test suites
+Running 1 test suites (1 total tests) across 1 processes
+.
+----------------------------------------------------------------------
+Ran 1 test in <SEC>s
+
+OK
+
+Total coverage is 100.00%
+''')
+
+    def test_shard_invalid(self):
+        for argv, message in (
+            (['--shard-index', '0'], '--shard-index and --shard-count must be used together'),
+            (['--shard-index', '2', '--shard-count', '2'], '--shard-index must be between 0 and --shard-count minus 1')
+        ):
+            with patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr:
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(argv)
+
+            self.assertEqual(cm_exc.exception.code, 2)
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertTrue(stderr.getvalue().endswith(f'unittest-parallel: error: {message}\n'))
+
+    def test_serve(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')]),
+                unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as socket_dir:
+            address = os.path.join(socket_dir, 'socket')
+            with patch.dict('os.environ', {'UNITTEST_PARALLEL_AUTHKEY': 'secret'}), \
+                 patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                worker_thread = threading.Thread(target=main, args=(['--worker', address],))
+                worker_thread.start()
+                main(['-q', '--level', 'class', '--serve', address])
+                worker_thread.join()
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), f'''\
+Running 2 test suites (3 total tests) across --worker processes
+Serving at {address}
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK
+''')
+
+    def test_serve_failfast(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[FailureTestCase('mock_2')]),
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as socket_dir:
+            address = os.path.join(socket_dir, 'socket')
+            with patch.dict('os.environ', {'UNITTEST_PARALLEL_AUTHKEY': 'secret'}), \
+                 patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                worker_thread = threading.Thread(target=main, args=(['--worker', address],))
+                worker_thread.start()
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(['-q', '--failfast', '--level', 'class', '--serve', address])
+                worker_thread.join()
+
+        self.assertEqual(cm_exc.exception.code, 1)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertIn('Ran 1 test in ', stderr.getvalue())
+        self.assertIn('FAILED (failures=1)', stderr.getvalue())
+
+    def test_serve_invalid(self):
+        for environ, argv, message in (
+            ({'UNITTEST_PARALLEL_AUTHKEY': 'secret'}, ['--serve', 'a', '--worker', 'b'],
+             '--serve and --worker cannot be used together'),
+            ({}, ['--serve', 'localhost:8000'], '--serve and --worker require the UNITTEST_PARALLEL_AUTHKEY environment variable'),
+            ({'UNITTEST_PARALLEL_AUTHKEY': 'secret'}, ['--serve', 'a', '--coverage-per-process'],
+             '--serve does not support --coverage-per-process')
+        ):
+            with patch.dict('os.environ', environ, clear=True), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr:
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(argv)
+
+            self.assertEqual(cm_exc.exception.code, 2)
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertTrue(stderr.getvalue().endswith(f'unittest-parallel: error: {message}\n'))
+
+    def test_success_level_fixture(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[ClassFixtureTestCase('mock_1'), ClassFixtureTestCase('mock_2')]),
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')])
+                ])
+            ])
+
+        # Test classes with class fixtures are not split - other tests are run individually
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.object(ClassFixtureTestCase, 'setup_count', 0), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+            main(['--level', 'fixture'])
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (4 total tests) across 1 processes
+....
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+''')
+
+        # Test modules with module fixtures are not split
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.object(ClassFixtureTestCase, 'setup_count', 0), \
+             patch.object(sys.modules[__name__], 'setUpModule', create=True) as setup_module_mock, \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+            main(['--level', 'fixture'])
+
+        setup_module_mock.assert_called_once_with()
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (4 total tests) across 1 processes
+....
+----------------------------------------------------------------------
+Ran 4 tests in <SEC>s
+
+OK
+''')
+
+    def test_level_auto(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')]),
+                    unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+                ]),
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase3('mock_1')])
+                ]),
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SkipTestCase('mock_1')])
+                ])
+            ])
+
+        def write_durations():
+            with open(os.path.join(cache_dir, 'durations.json'), 'w', encoding='utf-8') as durations_file:
+                json.dump({
+                    'tests.test_main.SuccessTestCase.mock_1': 1,
+                    'tests.test_main.SuccessTestCase.mock_2': 1,
+                    'tests.test_main.SuccessTestCase.mock_3': 1,
+                    'tests.test_main.SuccessTestCase2.mock_1': 1,
+                    'tests.test_main.SuccessTestCase3.mock_1': 0.1,
+                    'tests.test_main.SkipTestCase.mock_1': 0.1
+                }, durations_file)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # The expensive module is split into its classes and the small suites are batched
+            write_durations()
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+                main(['--level', 'auto', '--cache-dir', cache_dir])
+            with open(os.path.join(cache_dir, 'durations.json'), encoding='utf-8') as durations_file:
+                durations = json.load(durations_file)
+
+            self.assertListEqual(sorted(durations.keys()), [
+                'tests.test_main.SkipTestCase.mock_1',
+                'tests.test_main.SuccessTestCase',
+                'tests.test_main.SuccessTestCase.mock_1',
+                'tests.test_main.SuccessTestCase.mock_2',
+                'tests.test_main.SuccessTestCase.mock_3',
+                'tests.test_main.SuccessTestCase2.mock_1',
+                'tests.test_main.SuccessTestCase2.mock_1,tests.test_main.SuccessTestCase3.mock_1',
+                'tests.test_main.SuccessTestCase3.mock_1'
+            ])
+            self.assertEqual(stdout.getvalue(), '')
+            self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (6 total tests) across 1 processes
+......
+----------------------------------------------------------------------
+Ran 6 tests in <SEC>s
+
+OK
+''')
+
+            # Modules with module fixtures are not split
+            write_durations()
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)), \
+                 patch.object(sys.modules[__name__], 'setUpModule', Mock(), create=True):
+                main(['--level', 'auto', '--cache-dir', cache_dir])
+
+            self.assertEqual(stdout.getvalue(), '')
+            self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (6 total tests) across 1 processes
+......
+----------------------------------------------------------------------
+Ran 6 tests in <SEC>s
+
+OK
+''')
+
+    def test_batch_size(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')]),
+                unittest.TestSuite(tests=[SuccessTestCase2('mock_1'), SuccessTestCase3('mock_1')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['-v', '--level', 'test', '--batch-size', '2'])
+
+        self.assertEqual(stdout.getvalue(), '')
+        if sys.version_info < (3, 11): # pragma: no cover
+            self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (5 total tests) across 1 processes
+
+mock_1 (tests.test_main.SuccessTestCase) ...
+mock_1 (tests.test_main.SuccessTestCase) ... ok
+mock_2 (tests.test_main.SuccessTestCase) ...
+mock_2 (tests.test_main.SuccessTestCase) ... ok
+mock_3 (tests.test_main.SuccessTestCase) ...
+mock_3 (tests.test_main.SuccessTestCase) ... ok
+mock_1 (tests.test_main.SuccessTestCase2) ...
+mock_1 (tests.test_main.SuccessTestCase2) ... ok
+mock_1 (tests.test_main.SuccessTestCase3) ...
+mock_1 (tests.test_main.SuccessTestCase3) ... ok
+
+----------------------------------------------------------------------
+Ran 5 tests in <SEC>s
+
+OK
+''')
+        else: # pragma: no cover
+            self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (5 total tests) across 1 processes
+
+mock_1 (tests.test_main.SuccessTestCase.mock_1) ...
+mock_1 (tests.test_main.SuccessTestCase.mock_1) ... ok
+mock_2 (tests.test_main.SuccessTestCase.mock_2) ...
+mock_2 (tests.test_main.SuccessTestCase.mock_2) ... ok
+mock_3 (tests.test_main.SuccessTestCase.mock_3) ...
+mock_3 (tests.test_main.SuccessTestCase.mock_3) ... ok
+mock_1 (tests.test_main.SuccessTestCase2.mock_1) ...
+mock_1 (tests.test_main.SuccessTestCase2.mock_1) ... ok
+mock_1 (tests.test_main.SuccessTestCase3.mock_1) ...
+mock_1 (tests.test_main.SuccessTestCase3.mock_1) ... ok
+
+----------------------------------------------------------------------
+Ran 5 tests in <SEC>s
+
+OK
+''')
+
+    def test_batch_size_key(self):
+        for send_test_ids in (False, True):
+            discover_suite = unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')]),
+                    unittest.TestSuite(tests=[SuccessTestCase2('mock_1'), SuccessTestCase3('mock_1')])
+                ])
+            ])
+            with tempfile.TemporaryDirectory() as cache_dir:
+                with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                     patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                     patch('sys.stdout', StringIO()) as stdout, \
+                     patch('sys.stderr', StringIO()) as stderr, \
+                     patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                    main(
+                        ['--level', 'test', '--batch-size', '2', '--cache-dir', cache_dir] +
+                        (['--send-test-ids'] if send_test_ids else [])
+                    )
+                with open(os.path.join(cache_dir, 'durations.json'), encoding='utf-8') as durations_file:
+                    durations = json.load(durations_file)
+
+            # A batch has its own test suite key rather than its test class's or test module's key
+            self.assertListEqual(sorted(durations.keys()), [
+                'tests.test_main.SuccessTestCase.mock_1,tests.test_main.SuccessTestCase.mock_2',
+                'tests.test_main.SuccessTestCase.mock_3,tests.test_main.SuccessTestCase2.mock_1',
+                'tests.test_main.SuccessTestCase3.mock_1'
+            ])
+            self.assertEqual(stdout.getvalue(), '')
+            self.assert_output(stderr.getvalue(), '''\
+Running 3 test suites (5 total tests) across 1 processes
+.....
+----------------------------------------------------------------------
+Ran 5 tests in <SEC>s
+
+OK
+''')
+
+    def test_min_batch_ms(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2'), SuccessTestCase('mock_3')]),
+                unittest.TestSuite(tests=[SuccessTestCase2('mock_1'), SuccessTestCase3('mock_1')])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with open(os.path.join(cache_dir, 'durations.json'), 'w', encoding='utf-8') as durations_file:
+                json.dump({
+                    'tests.test_main.SuccessTestCase.mock_1': 0.002,
+                    'tests.test_main.SuccessTestCase.mock_2': 0.002,
+                    'tests.test_main.SuccessTestCase.mock_3': 0.002,
+                    'tests.test_main.SuccessTestCase2.mock_1': 0.002
+                }, durations_file)
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                main(['--level', 'test', '--cache-dir', cache_dir, '--min-batch-ms', '5'])
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (5 total tests) across 1 processes
+.....
+----------------------------------------------------------------------
+Ran 5 tests in <SEC>s
+
+OK
+''')
+
+    def test_batch_invalid(self):
+        for argv, message in (
+            (['--batch-size', '0'], '--batch-size must be at least 1'),
+            (['--min-batch-ms', '0'], '--min-batch-ms must be greater than 0')
+        ):
+            with patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr:
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(argv)
+
+            self.assertEqual(cm_exc.exception.code, 2)
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertTrue(stderr.getvalue().endswith(f'unittest-parallel: error: {message}\n'))
+
+    def test_max_tasks_per_worker(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.object(
+                 MockMultiprocessingContext, 'Pool', autospec=True, side_effect=MockMultiprocessingContext.Pool
+             ) as pool_mock, \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['--max-tasks-per-worker', '10'])
+
+        self.assertEqual(pool_mock.call_args.kwargs['maxtasksperchild'], 10)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (1 total tests) across 1 processes
+.
+----------------------------------------------------------------------
+Ran 1 test in <SEC>s
+
+OK
+''')
+
+    def test_max_worker_memory(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')]),
+                    unittest.TestSuite(tests=[SuccessTestCase2('mock_1')]),
+                    unittest.TestSuite(tests=[SuccessTestCase3('mock_1')])
+                ])
+            ])
+
+        # Test processes exceeding the memory limit are replaced after each test suite
+        for worker_memory, process_count in ((100, 3), (10, 2)):
+            with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch.object(
+                     MockMultiprocessingContext, 'Process', autospec=True, side_effect=MockMultiprocessingContext.Process
+                 ) as process_mock, \
+                 patch('unittest_parallel.main._worker_memory', Mock(return_value=worker_memory)), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+                main(['--level', 'class', '--max-worker-memory', '50'])
+
+            self.assertEqual(process_mock.call_count, process_count)
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertRegex(stderr.getvalue(), r'\nRan 4 tests in \d+\.\d{3}s\n\nOK\n$')
+
+    @unittest.skipUnless(os.path.exists('/proc/self/statm'), 'requires /proc/self/statm')
+    def test_max_worker_memory_current(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')]),
+                    unittest.TestSuite(tests=[SuccessTestCase2('mock_1')]),
+                    unittest.TestSuite(tests=[SuccessTestCase3('mock_1')])
+                ])
+            ])
+
+        # The current memory is used, not the peak memory (which a spawned process inherits from its parent)
+        max_rss = Mock(ru_maxrss=100 * 1024 * 1024)
+        with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.object(
+                 MockMultiprocessingContext, 'Process', autospec=True, side_effect=MockMultiprocessingContext.Process
+             ) as process_mock, \
+             patch('resource.getrusage', Mock(return_value=max_rss)), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+            main(['--level', 'class', '--max-worker-memory', '10000'])
+
+        self.assertEqual(process_mock.call_count, 2)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertRegex(stderr.getvalue(), r'\nRan 4 tests in \d+\.\d{3}s\n\nOK\n$')
+
+    def test_max_worker_memory_exit(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')]),
+                unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+            ])
+        ])
+        run_tests = unittest_parallel.main.ParallelTestManager.run_tests
+
+        def run_tests_exit(self, test_suite):
+            if any(isinstance(test_case, SuccessTestCase2) for test_case in test_suite):
+                raise Exception('exit')
+            return run_tests(self, test_suite)
+
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('unittest_parallel.main.ParallelTestManager.run_tests', run_tests_exit), \
+             patch('threading.excepthook'), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--level', 'class', '--max-worker-memory', '50'])
+
+        self.assertEqual(cm_exc.exception.code, 1)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (2 total tests) across 1 processes
+.
+======================================================================
+ERROR: tests.test_main.SuccessTestCase2.mock_1
+----------------------------------------------------------------------
+Test process exited unexpectedly (exit code None)
+
+----------------------------------------------------------------------
+Ran 1 test in <SEC>s
+
+FAILED (errors=1)
+''')
+
+    def test_max_worker_memory_reset(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')]),
+                unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+            ])
+        ])
+
+        # Simulate test processes that exit before reading their test task
+        def supervised_worker_reset(connection, *unused_args):
+            time.sleep(0.05)
+            connection.close()
+
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch('unittest_parallel.main._supervised_worker', supervised_worker_reset), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--level', 'class', '--max-worker-memory', '50'])
+
+        self.assertEqual(cm_exc.exception.code, 2)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (2 total tests) across 1 processes
+
+======================================================================
+ERROR: tests.test_main.SuccessTestCase.mock_1
+----------------------------------------------------------------------
+Test process exited unexpectedly (exit code None)
+
+======================================================================
+ERROR: tests.test_main.SuccessTestCase2.mock_1
+----------------------------------------------------------------------
+Test process exited unexpectedly (exit code None)
+
+----------------------------------------------------------------------
+Ran 0 test in <SEC>s
+
+FAILED (errors=2)
+''')
+
+    def test_timeout(self):
+        def create_discover_suite(*unused_args, **unused_kwargs):
+            return unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    unittest.TestSuite(tests=[HangTestCase('mock_1')]),
+                    unittest.TestSuite(tests=[SuccessTestCase('mock_1'), SuccessTestCase('mock_2')])
+                ])
+            ])
+
+        # The timed out test process is killed and replaced, and its stack is reported
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.object(
+                 MockMultiprocessingContext, 'Process', autospec=True, side_effect=MockMultiprocessingContext.Process
+             ) as process_mock, \
+             patch('threading.excepthook'), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--level', 'class', '--timeout', '0.1'])
+
+        self.assertEqual(cm_exc.exception.code, 1)
+        self.assertEqual(process_mock.call_count, 2)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertRegex(
+            stderr.getvalue(),
+            r'\nERROR: tests\.test_main\.HangTestCase\.mock_1\n-+\nTest suite timed out after 0\.1 seconds\n\nTimeout \(.*\)!\n'
+            r'(?:.*\n)*  File ".*test_main\.py", line \d+ in mock_1\n'
+        )
+        self.assertRegex(stderr.getvalue(), r'\nRan 2 tests in \d+\.\d{3}s\n\nFAILED \(errors=1\)\n$')
+
+        # Stop the test run at the total timeout
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.object(
+                 MockMultiprocessingContext, 'Process', autospec=True, side_effect=MockMultiprocessingContext.Process
+             ) as process_mock, \
+             patch('threading.excepthook'), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(side_effect=create_discover_suite)):
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--level', 'class', '--total-timeout', '0.1'])
+
+        # The test suites not started are reported as errors
+        self.assertEqual(cm_exc.exception.code, 2)
+        self.assertEqual(process_mock.call_count, 1)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertRegex(
+            stderr.getvalue(),
+            r'\nERROR: tests\.test_main\.HangTestCase\.mock_1\n-+\nTest run timed out after 0\.1 seconds\n\nTimeout \(.*\)!\n'
+        )
+        self.assertIn(
+            '\nERROR: tests.test_main.SuccessTestCase\n'
+            f'{unittest.TextTestResult.separator2}\n'
+            'Test suite not run - test run timed out after 0.1 seconds\n',
+            stderr.getvalue()
+        )
+        self.assertRegex(stderr.getvalue(), r'\nRan 0 test in \d+\.\d{3}s\n\nFAILED \(errors=2\)\n$')
+
+    def test_total_timeout_start(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')]),
+                unittest.TestSuite(tests=[SuccessTestCase2('mock_1')])
+            ])
+        ])
+
+        # The total timeout expires while the test processes start
+        def process_slow_start(self, target, args, daemon=None):
+            time.sleep(0.05)
+            return MockMultiprocessingProcess(target, args)
+
+        with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.object(MockMultiprocessingContext, 'Process', process_slow_start), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--level', 'class', '--total-timeout', '0.01'])
+
+        self.assertEqual(cm_exc.exception.code, 2)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (2 total tests) across 2 processes
+
+======================================================================
+ERROR: tests.test_main.SuccessTestCase.mock_1
+----------------------------------------------------------------------
+Test suite not run - test run timed out after 0.01 seconds
+
+======================================================================
+ERROR: tests.test_main.SuccessTestCase2.mock_1
+----------------------------------------------------------------------
+Test suite not run - test run timed out after 0.01 seconds
+
+----------------------------------------------------------------------
+Ran 0 test in <SEC>s
+
+FAILED (errors=2)
+''')
+
+    def test_timeout_report(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[HangTestCase('mock_1')]),
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')])
+            ])
+        ])
+
+        # Timed out test suites are included in the test reports
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_json_path = os.path.join(report_dir, 'report.json')
+            junit_xml_path = os.path.join(report_dir, 'report.xml')
+            with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+                 patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+                 patch('threading.excepthook'), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()), \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(['--level', 'class', '--timeout', '0.1', '--report-json', report_json_path, '--junit-xml', junit_xml_path])
+            with open(report_json_path, encoding='utf-8') as report_file:
+                report = json.load(report_file)
+            with open(junit_xml_path, encoding='utf-8') as junit_xml_file:
+                junit_xml = junit_xml_file.read()
+
+        self.assertEqual(cm_exc.exception.code, 1)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertListEqual(
+            sorted((test['id'], test['outcome']) for test in report['tests']),
+            [('tests.test_main.HangTestCase.mock_1', 'error'), ('tests.test_main.SuccessTestCase.mock_1', 'success')]
+        )
+        error_test = next(test for test in report['tests'] if test['outcome'] == 'error')
+        self.assertTrue(error_test['message'].startswith('Test suite timed out after 0.1 seconds\n'))
+        self.assertGreaterEqual(error_test['duration'], 0.1)
+        self.assertIn('<testsuites name="unittest-parallel" time="', junit_xml)
+        self.assertIn('tests="2" failures="0" errors="1" skipped="0">', junit_xml)
+
+    def test_timeout_invalid(self):
+        for argv, message in (
+            (['--timeout', '0'], '--timeout and --total-timeout must be greater than 0'),
+            (['--total-timeout', '-1'], '--timeout and --total-timeout must be greater than 0'),
+            (
+                ['--timeout', '10', '--serve', 'localhost:0'],
+                '--serve does not support --max-worker-memory, --timeout, or --total-timeout'
+            )
+        ):
+            with patch.dict('os.environ', {'UNITTEST_PARALLEL_AUTHKEY': 'secret'}), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr:
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(argv)
+
+            self.assertEqual(cm_exc.exception.code, 2)
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertTrue(stderr.getvalue().endswith(f'unittest-parallel: error: {message}\n'))
+
+    def test_worker_init(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.dict('os.environ'), \
+             patch(f'{__name__}.WORKER_HOOK_CALLS', []) as worker_hook_calls, \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main([
+                '--worker-init', f'{__name__}.mock_worker_init',
+                '--worker-finalize', f'{__name__}.mock_worker_finalize'
+            ])
+
+        self.assertListEqual(worker_hook_calls, [('init', '0'), ('finalize', '0')])
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 1 test suites (1 total tests) across 1 processes
+.
+----------------------------------------------------------------------
+Ran 1 test in <SEC>s
+
+OK
+''')
+
+    def test_worker_init_error(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')]),
+                unittest.TestSuite(tests=[SuccessTestCase('mock_2')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=1)), \
+             patch('multiprocessing.get_context', new=MockMultiprocessingContext), \
+             patch.dict('os.environ'), \
+             patch(f'{__name__}.WORKER_HOOK_CALLS', []) as worker_hook_calls, \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            with self.assertRaises(SystemExit) as cm_exc:
+                main([
+                    '--worker-init', f'{__name__}.mock_worker_init_error',
+                    '--worker-finalize', f'{__name__}.mock_worker_finalize'
+                ])
+
+        # The test process's test suites are reported as errors and the finalize function is not called
+        self.assertEqual(cm_exc.exception.code, 1)
+        self.assertListEqual(worker_hook_calls, [('init', '0')])
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertRegex(stderr.getvalue(), r'''^Running 1 test suites \(2 total tests\) across 1 processes
+
+=+
+ERROR: tests\.test_main\.SuccessTestCase
+-+
+Test process init function failed
+
+Traceback \(most recent call last\):
+(?:.*\n)*RuntimeError: Init error!
+
+-+
+Ran 0 test in \d+\.\d{3}s
+
+FAILED \(errors=1\)
+$''')
+
+    def test_executor_thread(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[
+                    SuccessWithOutputTestCase('mock_1'),
+                    SuccessWithOutputTestCase('mock_2'),
+                    SuccessWithOutputTestCase('mock_3')
+                ]),
+                unittest.TestSuite(tests=[FailureWithOutputTestCase('mock_1')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+             patch('multiprocessing.get_context') as get_context_mock, \
+             patch('coverage.Coverage') as coverage_mock, \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['--level', 'class', '--executor', 'thread', '-b', '--coverage'])
+
+        self.assertEqual(cm_exc.exception.code, 1)
+        get_context_mock.assert_not_called()
+
+        # Coverage is measured once for all threads
+        self.assertEqual(coverage_mock.return_value.start.call_count, 2)
+        self.assertEqual(coverage_mock.return_value.save.call_count, 2)
+
+        # Passing tests' output is buffered - failing tests' output is reported
+        self.assertEqual(stdout.getvalue(), '''\
+
+Stdout:
+Failure stdout!
+''')
+        self.assertIn('\nStderr:\nFailure stderr!\n', stderr.getvalue())
+        self.assertTrue(stderr.getvalue().startswith('Running 2 test suites (4 total tests) across 2 threads\n'))
+        self.assertRegex(stderr.getvalue(), r'''
+Traceback \(most recent call last\):
+(?:.*\n)*AssertionError: None
+
+Stdout:
+Failure stdout!
+
+Stderr:
+Failure stderr!
+
+-+
+Ran 4 tests in \d+\.\d{3}s
+
+FAILED \(failures=1\)
+$''')
+
+    def test_executor_thread_warnings(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[WarnsTestCase('mock_1')]),
+                unittest.TestSuite(tests=[WarnsTestCase2('mock_1')])
+            ])
+        ])
+        catch_warnings = warnings.catch_warnings
+        with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['--level', 'class', '--executor', 'thread'])
+
+        # The test threads' warnings contexts don't overwrite each other's
+        self.assertIs(warnings.catch_warnings, catch_warnings)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Running 2 test suites (2 total tests) across 2 threads
+..
+----------------------------------------------------------------------
+Ran 2 tests in <SEC>s
+
+OK
+''')
+
+    def test_executor_thread_durations(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SlowTestCase('mock_1')]),
+                unittest.TestSuite(tests=[SlowTestCase2('mock_1')])
+            ])
+        ])
+        with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+             patch('sys.stdout', StringIO()) as stdout, \
+             patch('sys.stderr', StringIO()) as stderr, \
+             patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+            main(['--level', 'class', '--executor', 'thread', '--durations', '0'])
+
+        # The busy time of each thread is reported
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertRegex(
+            stderr.getvalue(),
+            r'\nTest process busy time:\n'
+            r'  \d+\.\d{3}s process (\d+) thread \d+ \(1 test suites\)\n'
+            r'  \d+\.\d{3}s process \1 thread \d+ \(1 test suites\)\n'
+        )
+        lost_match = re.search(r'\nProcess time lost to imbalance: \d+\.\d{3}s \((\d+\.\d)%\)\n', stderr.getvalue())
+        self.assertIsNotNone(lost_match)
+        self.assertLess(float(lost_match.group(1)), 50)
+
+    def test_executor_thread_cache_dir(self):
+        discover_suite = unittest.TestSuite(tests=[
+            unittest.TestSuite(tests=[
+                unittest.TestSuite(tests=[SuccessTestCase('mock_1')]),
+                unittest.TestSuite(tests=[SuccessTestCase('mock_2')])
+            ])
+        ])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch('multiprocessing.cpu_count', Mock(return_value=2)), \
+                 patch('coverage.Coverage') as coverage_mock, \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr, \
+                 patch('unittest.TestLoader.discover', Mock(return_value=discover_suite)):
+                coverage_instance = coverage_mock.return_value
+                coverage_instance.report.return_value = 100.
+                main(['--level', 'test', '--executor', 'thread', '--coverage', '--cache-dir', cache_dir])
+
+            # Test threads share one coverage measurement, so test suite coverage contexts and impact data are not saved
+            coverage_instance.switch_context.assert_not_called()
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, 'impact.json')))
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, 'durations.json')))
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertTrue(stderr.getvalue().startswith('Running 2 test suites (2 total tests) across 2 threads\n'))
+        self.assertTrue(stderr.getvalue().endswith('\nOK\n\nTotal coverage is 100.00%\n'))
+
+    def test_executor_thread_invalid(self):
+        for argv in (['--serve', 'localhost:0'], ['--timeout', '10'], ['--profile', 'profile']):
+            with patch.dict('os.environ', {'UNITTEST_PARALLEL_AUTHKEY': 'secret'}), \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr:
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main(['--executor', 'thread', *argv])
+
+            self.assertEqual(cm_exc.exception.code, 2)
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertTrue(stderr.getvalue().endswith(
+                'unittest-parallel: error: --executor thread does not support --serve, --max-worker-memory, --timeout, '
+                '--total-timeout, or --profile\n'
+            ))
+
     def test_runner(self):
         discover_suite = unittest.TestSuite(tests=[
             unittest.TestSuite(tests=[
@@ -0,0 +1,126 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/unittest-parallel/blob/main/LICENSE
+
+from io import StringIO
+import json
+import os
+import re
+import tempfile
+import unittest
+from unittest.mock import call, patch
+
+from unittest_parallel.merge import main
+
+
+class TestMerge(unittest.TestCase):
+
+    def assert_output(self, actual, expected):
+        # Normalize test timing output
+        actual = re.sub(r'\d+\.\d{3}s', '<SEC>s', actual)
+
+        self.assertEqual(actual, expected)
+
+    @staticmethod
+    def write_reports(report_dir, *shard_reports):
+        report_paths = []
+        for ix_report, shard_report in enumerate(shard_reports):
+            report_path = os.path.join(report_dir, f'shard-{ix_report}.json')
+            with open(report_path, 'w', encoding='utf-8') as report_file:
+                json.dump(shard_report, report_file)
+            report_paths.append(report_path)
+        return report_paths
+
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_paths = self.write_reports(
+                report_dir,
+                {'duration': 2.5, 'tests': [
+                    {'id': 'tests.test_a.A.test_1', 'suite': 'tests.test_a', 'pid': 10, 'start': 2.0,
+                     'duration': 1.5, 'outcome': 'success', 'message': None},
+                    {'id': 'tests.test_a.A.test_2', 'suite': 'tests.test_a', 'pid': 10, 'start': 3.5,
+                     'duration': 0.5, 'outcome': 'skipped', 'message': 'skip reason'}
+                ]},
+                {'duration': 1.5, 'tests': [
+                    {'id': 'tests.test_b.B.test_1', 'suite': 'tests.test_b', 'pid': 20, 'start': 1.0,
+                     'duration': 1.0, 'outcome': 'success', 'message': None}
+                ]}
+            )
+            merged_path = os.path.join(report_dir, 'merged.json')
+            cache_dir = os.path.join(report_dir, 'cache')
+            with patch('coverage.Coverage') as coverage_mock, \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr:
+                coverage_instance = coverage_mock.return_value
+                coverage_instance.report.return_value = 100.
+                main([
+                    *report_paths, '--report-json', merged_path, '--cache-dir', cache_dir,
+                    '--coverage-data', 'shard-0/.coverage', '--coverage-data', 'shard-1/.coverage'
+                ])
+            with open(merged_path, encoding='utf-8') as merged_file:
+                merged = json.load(merged_file)
+            with open(os.path.join(cache_dir, 'durations.json'), encoding='utf-8') as durations_file:
+                durations = json.load(durations_file)
+
+        self.assertEqual(merged['duration'], 2.5)
+        self.assertListEqual([test['id'] for test in merged['tests']], [
+            'tests.test_b.B.test_1',
+            'tests.test_a.A.test_1',
+            'tests.test_a.A.test_2'
+        ])
+        self.assertDictEqual(durations, {'tests.test_a': 2.0, 'tests.test_b': 1.0})
+        self.assertListEqual(coverage_mock.mock_calls, [
+            call(),
+            call().combine(data_paths=['shard-0/.coverage', 'shard-1/.coverage']),
+            call().save(),
+            call().report(ignore_errors=True, file=stderr)
+        ])
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Merged 2 shard test reports
+
+----------------------------------------------------------------------
+Ran 3 tests in <SEC>s
+
+OK (skipped=1)
+
+Total coverage is 100.00%
+''')
+
+    def test_merge_failure(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_paths = self.write_reports(
+                report_dir,
+                {'duration': 1.0, 'tests': [
+                    {'id': 'tests.test_a.A.test_1', 'suite': 'tests.test_a', 'pid': 10, 'start': 1.0,
+                     'duration': 0.5, 'outcome': 'failure', 'message': 'AssertionError\n'},
+                    {'id': 'tests.test_a.A.test_2', 'suite': 'tests.test_a', 'pid': 10, 'start': 1.5,
+                     'duration': 0.5, 'outcome': 'error', 'message': 'Exception\n'}
+                ]}
+            )
+            with patch('coverage.Coverage') as coverage_mock, \
+                 patch('sys.stdout', StringIO()) as stdout, \
+                 patch('sys.stderr', StringIO()) as stderr:
+                with self.assertRaises(SystemExit) as cm_exc:
+                    main([*report_paths, '--coverage-data', 'shard-0/.coverage'])
+
+        self.assertEqual(cm_exc.exception.code, 2)
+        coverage_mock.assert_not_called()
+        self.assertEqual(stdout.getvalue(), '')
+        self.assert_output(stderr.getvalue(), '''\
+Merged 1 shard test reports
+
+======================================================================
+ERROR: tests.test_a.A.test_2
+----------------------------------------------------------------------
+Exception
+
+======================================================================
+FAIL: tests.test_a.A.test_1
+----------------------------------------------------------------------
+AssertionError
+
+----------------------------------------------------------------------
+Ran 2 tests in <SEC>s
+
+FAILED (failures=1, errors=1)
+''')
@@ -6,19 +6,75 @@ unittest-parallel command-line script main module
 """
 
 import argparse
-from contextlib import contextmanager
+import ast
+import collections
+from contextlib import contextmanager, nullcontext
+import cProfile
+import faulthandler
+import fnmatch
 import importlib
 from io import StringIO
+import json
 import multiprocessing
+import multiprocessing.connection
+import multiprocessing.pool
+import multiprocessing.util
 import os
+import pstats
+import queue
+import re
+import subprocess
 import sys
 import tempfile
+import threading
 import time
+import traceback
 import unittest
+import warnings
+import xml.etree.ElementTree as ET
 
 import coverage
 
 
+# The minimum number of seconds between progress reports
+PROGRESS_INTERVAL = 5
+
+
+# The number of seconds a --worker process retries connecting to the --serve process
+WORKER_CONNECT_TIMEOUT = 30
+
+
+# The target number of test suites per test process for the 'auto' parallelism level
+AUTO_SUITES_PER_PROCESS = 4
+
+
+# The maximum number of seconds to wait for a timed out test process's stack dump
+TIMEOUT_DUMP_WAIT = 1
+
+
+# The number of seconds between --watch file change polls
+WATCH_INTERVAL = 0.5
+
+
+# The number of cumulative time profile hotspots to report
+PROFILE_HOTSPOTS = 20
+
+
+# Test module file name regular expression (as TestLoader.discover)
+RE_MODULE_FILE_NAME = re.compile(r'[_a-z]\w*\.py$', re.IGNORECASE)
+
+
+# Test process profile stats file name regular expression
+RE_WORKER_PROFILE = re.compile(r'^worker-\d+\.prof$')
+
+
+# A test suite result - the test records are (test_id, start_epoch, duration, outcome, message) tuples
+SuiteResult = collections.namedtuple('SuiteResult', [
+    'test_count', 'errors', 'failures', 'skipped', 'expected_failures', 'unexpected_successes', 'duration', 'suite_key',
+    'coverage_file', 'test_records', 'pid', 'thread_id', 'failed_test_ids'
+])
+
+
 def main(argv=None):
     """
     unittest-parallel command-line script main entry point
@@ -37,6 +93,8 @@ def main(argv=None):
                         help='Stop on first fail or error')
     parser.add_argument('-b', '--buffer', action='store_true', default=False,
                         help='Buffer stdout and stderr during tests')
+    parser.add_argument('--progress', action='store_true', default=False,
+                        help='Report failures as they occur and report test run progress')
     parser.add_argument('-k', dest='testNamePatterns', action='append', type=_convert_select_pattern,
                         help='Only run tests which match the given substring')
     parser.add_argument('-s', '--start-directory', metavar='START', default='.',
@@ -45,6 +103,12 @@ def main(argv=None):
                         help="Pattern to match tests ('test*.py' default)")
     parser.add_argument('-t', '--top-level-directory', metavar='TOP',
                         help='Top level directory of project (defaults to start directory)')
+    parser.add_argument('--durations', metavar='N', type=int,
+                        help='Report the N slowest tests and test suites and the test process busy time (0 for all)')
+    parser.add_argument('--report-json', metavar='FILE',
+                        help="Write a JSON report of each test's start time, duration, process ID, outcome, and test suite")
+    parser.add_argument('--junit-xml', metavar='FILE',
+                        help='Write a JUnit XML test report')
     parser.add_argument('--runner', metavar='RUNNER',
                         help='Custom unittest runner class <module>.<class>')
     parser.add_argument('--result', metavar='RESULT',
@@ -52,15 +116,70 @@ def main(argv=None):
     group_parallel = parser.add_argument_group('parallelization options')
     group_parallel.add_argument('-j', '--jobs', metavar='COUNT', type=int, default=0,
                                 help='The number of test processes (default is 0, all cores)')
-    group_parallel.add_argument('--level', choices=['module', 'class', 'test'], default='module',
+    group_parallel.add_argument('--level', choices=['module', 'class', 'test', 'fixture', 'auto'], default='module',
                                 help="Set the test parallelism level (default is 'module')")
+    group_parallel.add_argument('--batch-size', metavar='COUNT', type=int,
+                                help='Batch up to COUNT consecutive test suites into one test suite')
+    group_parallel.add_argument('--min-batch-ms', metavar='MS', type=float,
+                                help='Batch consecutive test suites until their saved durations total at least MS milliseconds')
     group_parallel.add_argument('--disable-process-pooling', action='store_true', default=False,
                                 help='Do not reuse processes used to run test suites')
+    group_parallel.add_argument('--timeout', metavar='SECONDS', type=float,
+                                help='Kill and replace test processes whose test suite runs longer than SECONDS and report '
+                                     "the test process's stack")
+    group_parallel.add_argument('--total-timeout', metavar='SECONDS', type=float,
+                                help='Stop the test run after SECONDS and report the unfinished test suites as errors')
+    group_parallel.add_argument('--max-tasks-per-worker', metavar='COUNT', type=int,
+                                help='Replace test processes after they run COUNT test suites')
+    group_parallel.add_argument('--max-worker-memory', metavar='MB', type=float,
+                                help='Replace test processes after a test suite when their memory exceeds MB megabytes')
+    group_parallel.add_argument('--executor', choices=['process', 'thread'], default='process',
+                                help='Run test suites in test processes or on threads in the unittest-parallel process '
+                                     "(default is 'process')")
+    group_parallel.add_argument('--start-method', choices=['spawn', 'fork', 'forkserver'], default='spawn',
+                                help="The test process start method (default is 'spawn')")
+    group_parallel.add_argument('--preload', metavar='MODULE', action='append',
+                                help="Module to preload in the 'forkserver' server process (default is the test modules)")
+    group_parallel.add_argument('--send-test-ids', action='store_true', default=False,
+                                help='Send test IDs to test processes rather than pickled test suites')
+    group_parallel.add_argument('--dispatch', choices=['static', 'dynamic'], default='static',
+                                help="Dispatch test suites in chunks ('static') or one at a time to idle processes ('dynamic')")
+    group_parallel.add_argument('--cache-dir', metavar='DIR',
+                                help='Save test suite durations (and coverage impact data) to DIR and run the '
+                                     'longest test suites first')
+    group_parallel.add_argument('--parallel-discovery', action='store_true', default=False,
+                                help='Import and load the test modules in parallel in the test processes')
+    group_parallel.add_argument('--cache-discovery', action='store_true', default=False,
+                                help='Save discovered tests to the cache directory and reuse them if the test files are unchanged')
+    group_parallel.add_argument('--affected-since', metavar='REF',
+                                help='Run only test suites affected by files changed since a git REF (or listed in file REF)')
+    group_parallel.add_argument('--failed-first', action='store_true',
+                                help='Run the test suites that failed in the last run first')
+    group_parallel.add_argument('--last-failed', action='store_true',
+                                help='Run only the test suites that failed in the last run (or all test suites if none failed)')
+    group_parallel.add_argument('--watch', action='store_true',
+                                help='Watch the top-level directory for file changes and rerun the affected test suites')
+    group_parallel.add_argument('--shard-index', metavar='I', type=int,
+                                help='Run only the test suites of shard I (0 to N-1)')
+    group_parallel.add_argument('--shard-count', metavar='N', type=int,
+                                help='Split the test suites into N shards balanced by the saved test suite durations')
+    group_parallel.add_argument('--serve', metavar='ADDRESS',
+                                help='Serve test suites to --worker processes at ADDRESS (HOST:PORT or a UNIX socket path)')
+    group_parallel.add_argument('--worker', metavar='ADDRESS',
+                                help='Run the test suites served at ADDRESS using COUNT (--jobs) test processes')
+    group_parallel.add_argument('--worker-init', metavar='FUNC',
+                                help='Call <module>.<function> once in each test process before it runs test suites')
+    group_parallel.add_argument('--worker-finalize', metavar='FUNC',
+                                help='Call <module>.<function> once in each test process when it exits')
+    group_parallel.add_argument('--profile', metavar='DIR',
+                                help='Profile each test process and save the merged profile stats to DIR')
     group_coverage = parser.add_argument_group('coverage options')
     group_coverage.add_argument('--coverage', action='store_true',
                                 help='Run tests with coverage')
     group_coverage.add_argument('--coverage-branch', action='store_true',
                                 help='Run tests with branch coverage')
+    group_coverage.add_argument('--coverage-per-process', action='store_true',
+                                help='Measure coverage once per test process rather than once per test suite')
     group_coverage.add_argument('--coverage-rcfile', metavar='RCFILE',
                                 help='Specify coverage configuration file')
     group_coverage.add_argument('--coverage-include', metavar='PAT', action='append',
@@ -69,21 +188,58 @@ def main(argv=None):
                                 help='Omit files matching one of these patterns. Accepts shell-style (quoted) wildcards.')
     group_coverage.add_argument('--coverage-source', metavar='SRC', action='append',
                                 help='A list of packages or directories of code to be measured')
-    group_coverage.add_argument('--coverage-html', metavar='DIR',
-                                help='Generate coverage HTML report')
-    group_coverage.add_argument('--coverage-xml', metavar='FILE',
-                                help='Generate coverage XML report')
-    group_coverage.add_argument('--coverage-fail-under', metavar='MIN', type=float,
-                                help='Fail if coverage percentage under min')
+    _add_coverage_report_arguments(group_coverage)
     args = parser.parse_args(args=argv)
     if args.coverage_branch:
         args.coverage = True
+    if args.affected_since is not None and args.cache_dir is None:
+        parser.error('--affected-since requires --cache-dir')
+    if args.cache_discovery and args.cache_dir is None:
+        parser.error('--cache-discovery requires --cache-dir')
+    if (args.failed_first or args.last_failed) and args.cache_dir is None:
+        parser.error('--failed-first and --last-failed require --cache-dir')
+    if args.serve is not None and args.worker is not None:
+        parser.error('--serve and --worker cannot be used together')
+    if (args.serve is not None or args.worker is not None) and not os.environ.get('UNITTEST_PARALLEL_AUTHKEY'):
+        parser.error('--serve and --worker require the UNITTEST_PARALLEL_AUTHKEY environment variable')
+    if args.serve is not None and args.coverage_per_process:
+        parser.error('--serve does not support --coverage-per-process')
+    if args.max_tasks_per_worker is not None and args.max_tasks_per_worker < 1:
+        parser.error('--max-tasks-per-worker must be at least 1')
+    if args.serve is not None and (args.max_worker_memory is not None or args.timeout is not None or args.total_timeout is not None):
+        parser.error('--serve does not support --max-worker-memory, --timeout, or --total-timeout')
+    if (args.timeout is not None and args.timeout <= 0) or (args.total_timeout is not None and args.total_timeout <= 0):
+        parser.error('--timeout and --total-timeout must be greater than 0')
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error('--batch-size must be at least 1')
+    if args.min_batch_ms is not None and args.min_batch_ms <= 0:
+        parser.error('--min-batch-ms must be greater than 0')
+    if (args.shard_index is None) != (args.shard_count is None):
+        parser.error('--shard-index and --shard-count must be used together')
+    if args.shard_count is not None and not 0 <= args.shard_index < args.shard_count:
+        parser.error('--shard-index must be between 0 and --shard-count minus 1')
+    if args.executor == 'thread' and (
+            args.serve is not None or args.max_worker_memory is not None or args.timeout is not None or
+            args.total_timeout is not None or args.profile is not None
+    ):
+        parser.error('--executor thread does not support --serve, --max-worker-memory, --timeout, --total-timeout, or --profile')
+    if args.watch and (args.serve is not None or args.worker is not None or args.start_method == 'forkserver'):
+        parser.error('--watch does not support --serve, --worker, or --start-method forkserver')
+
+    # Test threads share this process's coverage measurement
+    if args.executor == 'thread':
+        args.coverage_per_process = True
 
     # Determine the number of test processes
     process_count = max(0, args.jobs)
     if process_count == 0:
         process_count = multiprocessing.cpu_count()
 
+    # Run test suites served by a --serve process?
+    if args.worker is not None:
+        _run_worker(args, process_count)
+        return
+
     # Load the custom runner class (if provided)
     if args.runner is not None:
         runner_module_name, runner_class_name = args.runner.rsplit('.', 1)
@@ -96,91 +252,264 @@ def main(argv=None):
         result_module = importlib.import_module(result_module_name)
         args.result_class = getattr(result_module, result_class_name)
 
+    # Load the test process init and finalize functions (if provided)
+    args.worker_init_func = None
+    if args.worker_init is not None:
+        worker_init_module_name, worker_init_func_name = args.worker_init.rsplit('.', 1)
+        args.worker_init_func = getattr(importlib.import_module(worker_init_module_name), worker_init_func_name)
+    args.worker_finalize_func = None
+    if args.worker_finalize is not None:
+        worker_finalize_module_name, worker_finalize_func_name = args.worker_finalize.rsplit('.', 1)
+        args.worker_finalize_func = getattr(importlib.import_module(worker_finalize_module_name), worker_finalize_func_name)
+
+    # Watch for file changes and rerun the affected test suites?
+    if args.watch:
+        _watch_tests(args, parser, process_count)
+        return
+
+    # Run the tests
+    _run_tests(args, parser, process_count)
+
+
+# Discover and run the tests - test suites of the unaffected test modules are not run (--watch)
+def _run_tests(args, parser, process_count, unaffected_modules=None):
     # Create the temporary directory (for coverage files)
     with tempfile.TemporaryDirectory() as temp_dir:
 
         # Discover tests
-        with _coverage(args, temp_dir):
-            test_loader = unittest.TestLoader()
-            if args.testNamePatterns:
-                test_loader.testNamePatterns = args.testNamePatterns
-            discover_suite = test_loader.discover(args.start_directory, pattern=args.pattern, top_level_dir=args.top_level_directory)
+        discover_suite, discover_coverage_file, is_discovery_by_id = _discover_tests(args, temp_dir, process_count)
 
         # Get the parallelizable test suites
+        suite_durations = _load_cache(args, 'durations')
         if args.level == 'test':
             test_suites = list(_iter_test_cases(discover_suite))
         elif args.level == 'class':
             test_suites = list(_iter_class_suites(discover_suite))
+        elif args.level == 'fixture':
+            test_suites = _fixture_level_suites(discover_suite)
+        elif args.level == 'auto':
+            test_suites = _auto_level_suites(discover_suite, suite_durations, process_count)
         else: # args.level == 'module'
             test_suites = list(_iter_module_suites(discover_suite))
 
+        # Run only the test suites affected by changed files?
+        if args.affected_since is not None:
+            changed_files = _changed_files(args.affected_since)
+            suite_count = len(test_suites)
+            test_suites = _affected_suites(test_suites, _load_cache(args, 'impact'), changed_files)
+            print(f'{len(test_suites)} of {suite_count} test suites affected by {len(changed_files)} changed files', file=sys.stderr)
+
+        # Run only the test suites affected by changed files (--watch)?
+        if unaffected_modules is not None:
+            suite_count = len(test_suites)
+            test_suites = [
+                test_suite for test_suite in test_suites
+                if not all(_test_module_name(test_case) in unaffected_modules for test_case in _iter_test_cases(test_suite))
+            ]
+            print(f'{len(test_suites)} of {suite_count} test suites affected by the changed files', file=sys.stderr)
+
+        # Run only the test suites that failed in the last run?
+        last_failed = _load_cache(args, 'lastfailed')
+        if args.last_failed and last_failed:
+            suite_count = len(test_suites)
+            test_suites = [test_suite for test_suite in test_suites if _is_failed_suite(test_suite, last_failed)]
+            print(f'{len(test_suites)} of {suite_count} test suites failed in the last run', file=sys.stderr)
+
+        # Run only this shard's test suites?
+        if args.shard_count is not None:
+            suite_count = len(test_suites)
+            test_suites = _shard_suites(test_suites, suite_durations, args.shard_index, args.shard_count)
+            print(
+                f'Shard {args.shard_index} of {args.shard_count} shards: {len(test_suites)} of {suite_count} test suites',
+                file=sys.stderr
+            )
+
+        # Batch the small 'auto' level test suites into roughly equal-cost test suites
+        if args.level == 'auto':
+            test_suites = _auto_batch_suites(test_suites, suite_durations, process_count)
+
+        # Batch consecutive test suites into one test suite? Test suites without a saved duration complete a
+        # --min-batch-ms batch.
+        if args.batch_size is not None or args.min_batch_ms is not None:
+            batch_costs = [_suite_duration(test_suite, suite_durations) for test_suite in test_suites]
+            batch_costs = [duration if duration is not None else float('inf') for duration in batch_costs]
+            min_batch_cost = args.min_batch_ms / 1000 if args.min_batch_ms is not None else None
+            test_suites = _batch_suites(test_suites, batch_costs, max_count=args.batch_size, min_cost=min_batch_cost)
+
+        # Run the longest test suites first using the durations saved by previous runs
+        if suite_durations:
+            test_suites = _order_longest_first(test_suites, suite_durations)
+
+        # Run the test suites that failed in the last run first
+        if args.failed_first and last_failed:
+            failed_suites = [_is_failed_suite(test_suite, last_failed) for test_suite in test_suites]
+            test_suites = [test_suite for test_suite, is_failed in zip(test_suites, failed_suites) if is_failed] + \
+                [test_suite for test_suite, is_failed in zip(test_suites, failed_suites) if not is_failed]
+
+        # Get the test suite keys in dispatch order
+        suite_keys = [_suite_key(test_suite) for test_suite in test_suites]
+
+        # Get the test IDs of each test suite (for saving the failed tests)
+        suite_test_ids = {}
+        if args.cache_dir is not None:
+            suite_test_ids = {
+                suite_key: [test_case.id() for test_case in _iter_test_cases(test_suite)]
+                for suite_key, test_suite in zip(suite_keys, test_suites)
+            }
+
+        # Send test ID ranges to the test processes rather than pickled test suites?
+        test_ids = None
+        test_tasks = test_suites
+        if args.send_test_ids or is_discovery_by_id or args.serve is not None:
+            test_ids, test_tasks = _test_id_tasks(test_suites)
+
         # Don't use more processes than test suites
         process_count = max(1, min(len(test_suites), process_count))
 
         # Report test suites and processes
         print(
-            f'Running {len(test_suites)} test suites ({discover_suite.countTestCases()} total tests) across {process_count} processes',
+            f'Running {len(test_suites)} test suites ({sum(test_suite.countTestCases() for test_suite in test_suites)} total tests) '
+            f'across {process_count if args.serve is None else "--worker"} {"threads" if args.executor == "thread" else "processes"}',
             file=sys.stderr
         )
         if args.verbose > 1:
             print(file=sys.stderr)
 
-        # Run the tests in parallel
-        start_time = time.perf_counter()
-        multiprocessing_context = multiprocessing.get_context(method='spawn')
-        maxtasksperchild = 1 if args.disable_process_pooling else None
-        with multiprocessing_context.Pool(process_count, maxtasksperchild=maxtasksperchild) as pool, \
-             multiprocessing_context.Manager() as manager:
-            test_manager = ParallelTestManager(manager, args, temp_dir)
-            results = pool.map(test_manager.run_tests, test_suites)
-        stop_time = time.perf_counter()
-        test_duration = stop_time - start_time
-
-        # Aggregate parallel test run results
+        # Run the tests in parallel - test suite results are aggregated as they complete
         tests_run = 0
         errors = []
         failures = []
         skipped = 0
         expected_failures = 0
         unexpected_successes = 0
-        for result in results:
-            tests_run += result[0]
-            errors.extend(result[1])
-            failures.extend(result[2])
-            skipped += result[3]
-            expected_failures += result[4]
-            unexpected_successes += result[5]
+        results = []
+        cov = None
+        if args.coverage:
+            cov_options = {}
+            if args.coverage_rcfile is not None:
+                cov_options['config_file'] = args.coverage_rcfile
+            cov = coverage.Coverage(**cov_options)
+        start_time = time.perf_counter()
+        progress_time = start_time
+        if args.profile is not None:
+            _remove_worker_profiles(args.profile)
+        if args.serve is not None:
+            test_results = _serve_tests(args, temp_dir, test_ids, test_tasks)
+        elif args.executor == 'thread':
+            test_results = _thread_tests(args, temp_dir, process_count, test_ids, test_tasks)
+        elif args.max_worker_memory is not None or args.timeout is not None or args.total_timeout is not None:
+            test_results = _supervised_tests(args, temp_dir, process_count, discover_suite, test_ids, test_tasks, suite_keys)
+        else:
+            chunksize = 1 if args.dispatch == 'dynamic' or suite_durations else _static_chunksize(len(test_suites), process_count)
+            test_results = _pool_tests(args, temp_dir, process_count, discover_suite, test_ids, test_tasks, chunksize)
+        for result in test_results:
+            results.append(result)
+            tests_run += result.test_count
+            errors.extend(result.errors)
+            failures.extend(result.failures)
+            skipped += result.skipped
+            expected_failures += result.expected_failures
+            unexpected_successes += result.unexpected_successes
+
+            # Combine the test suite's coverage data file while the other test suites run
+            if result.coverage_file is not None:
+                cov.combine(data_paths=[result.coverage_file])
+
+            # Report progress - failures are reported as they occur
+            if args.progress:
+                for error in result.errors + result.failures:
+                    print(file=sys.stderr)
+                    print(error, file=sys.stderr)
+                progress_now = time.perf_counter()
+                if result.errors or result.failures or progress_now - progress_time >= PROGRESS_INTERVAL:
+                    progress_time = progress_now
+                    if args.verbose == 1 and not (result.errors or result.failures):
+                        print(file=sys.stderr)
+                    elapsed = progress_now - start_time
+                    suites_remaining = len(test_suites) - len(results)
+                    print(
+                        f'Progress: {tests_run} tests ({tests_run / elapsed:.1f} tests/s), '
+                        f'{suites_remaining} test suites remaining, ETA {elapsed / len(results) * suites_remaining:.3f}s',
+                        file=sys.stderr
+                    )
+
+        stop_time = time.perf_counter()
+        test_duration = stop_time - start_time
+
+        # Save the test suite (and test) durations for longest-first scheduling of later runs
+        if args.cache_dir is not None:
+            for result in results:
+                if result.duration is not None:
+                    suite_durations[result.suite_key] = result.duration
+                for test_id, _, duration, _, _ in result.test_records or ():
+                    suite_durations[test_id] = duration
+            _save_cache(args, 'durations', suite_durations)
+
+        # Save the failed tests for --failed-first and --last-failed - the tests of test suites that ran are replaced by
+        # the tests that failed
+        if args.cache_dir is not None:
+            run_keys = set()
+            for result in results:
+                for test_id in suite_test_ids.get(result.suite_key, ()):
+                    run_keys.update(_test_id_keys(test_id))
+            last_failed = {failed_id: True for failed_id in last_failed if failed_id not in run_keys}
+            for result in results:
+                for failed_id in result.failed_test_ids or ():
+                    last_failed[failed_id] = True
+            _save_cache(args, 'lastfailed', last_failed)
+
+        # Write the test reports
+        if args.report_json is not None or args.junit_xml is not None:
+            report = _test_report(results, test_duration)
+            if args.report_json is not None:
+                _write_report_json(args.report_json, report)
+            if args.junit_xml is not None:
+                _write_junit_xml(args.junit_xml, report)
+
+        # Estimate the process idle time removed by dynamic dispatch (compared to static chunked dispatch)
+        if args.dispatch == 'dynamic':
+            result_durations = {result.suite_key: result.duration or 0 for result in results}
+            durations = [result_durations.get(suite_key, 0) for suite_key in suite_keys]
+            static_chunksize = _static_chunksize(len(durations), process_count)
+            idle_removed = _estimate_idle_time(durations, process_count, static_chunksize) - \
+                _estimate_idle_time(durations, process_count, 1)
+
         is_success = not(errors or failures or unexpected_successes)
 
-        # Compute test info
-        infos = []
-        if failures:
-            infos.append(f'failures={len(failures)}')
-        if errors:
-            infos.append(f'errors={len(errors)}')
-        if skipped:
-            infos.append(f'skipped={skipped}')
-        if expected_failures:
-            infos.append(f'expected failures={expected_failures}')
-        if unexpected_successes:
-            infos.append(f'unexpected successes={unexpected_successes}')
-
-        # Report test errors
-        if errors or failures:
+        # Report test errors (unless already reported as they occurred) - test suites complete in any order, so they are
+        # reported in test suite order
+        if (errors or failures) and not args.progress:
+            suite_indexes = {suite_key: suite_index for suite_index, suite_key in enumerate(suite_keys)}
+            suite_results = sorted(results, key=lambda result: suite_indexes.get(result.suite_key, len(suite_keys)))
             print(file=sys.stderr)
-            for error in errors:
-                print(error, file=sys.stderr)
-            for failure in failures:
-                print(failure, file=sys.stderr)
+            for result in suite_results:
+                for error in result.errors:
+                    print(error, file=sys.stderr)
+            for result in suite_results:
+                for failure in result.failures:
+                    print(failure, file=sys.stderr)
         elif args.verbose > 0:
             print(file=sys.stderr)
 
+        # Report the slowest tests and test suites - --worker test processes are not replaced, so each is a process slot
+        if args.durations is not None:
+            slot_count = process_count if args.serve is None else len({result.pid for result in results if result.pid is not None})
+            _print_durations(args.durations, results, slot_count, test_duration)
+            print(file=sys.stderr)
+
+        # Merge the test process profiles and report the cumulative time hotspots
+        if args.profile is not None:
+            _merge_profiles(args.profile)
+            print(file=sys.stderr)
+
         # Test report
         if not args.runner and not args.result:
-            print(unittest.TextTestResult.separator2, file=sys.stderr)
-            print(f'Ran {tests_run} {"tests" if tests_run > 1 else "test"} in {test_duration:.3f}s', file=sys.stderr)
-            print(file=sys.stderr)
-            print(f'{"OK" if is_success else "FAILED"}{" (" + ", ".join(infos) + ")" if infos else ""}', file=sys.stderr)
+            notes = []
+            if args.dispatch == 'dynamic':
+                notes.append(f'Dynamic dispatch removed an estimated {idle_removed:.3f}s of process idle time')
+            _test_summary(
+                tests_run, test_duration, len(errors), len(failures), skipped, expected_failures, unexpected_successes, notes
+            )
 
         # Return an error status on failure
         if not is_success:
@@ -189,29 +518,78 @@ def main(argv=None):
         # Coverage?
         if args.coverage:
 
-            # Combine the coverage files
-            cov_options = {}
-            if args.coverage_rcfile is not None:
-                cov_options['config_file'] = args.coverage_rcfile
-            cov = coverage.Coverage(**cov_options)
-            cov.combine(data_paths=[os.path.join(temp_dir, x) for x in os.listdir(temp_dir)])
+            # Combine the remaining coverage files (test suite coverage files are combined as test suites complete)
+            if args.coverage_per_process:
+                cov.combine(data_paths=[os.path.join(temp_dir, x) for x in os.listdir(temp_dir)])
+            elif discover_coverage_file is not None:
+                cov.combine(data_paths=[discover_coverage_file])
 
-            # Coverage report
-            print(file=sys.stderr)
-            percent_covered = cov.report(ignore_errors=True, file=sys.stderr)
-            print(f'Total coverage is {percent_covered:.2f}%', file=sys.stderr)
+            # Save the source files and lines run by each test suite (for --affected-since) - not available for test
+            # threads since they share one coverage measurement
+            if args.cache_dir is not None and args.executor != 'thread':
+                _save_impact(args, cov)
+
+            # Save the shard's coverage data file (for merging with unittest-parallel-merge)
+            if args.shard_count is not None:
+                cov.save()
+
+            # Coverage reports
+            _coverage_report(args, parser, cov)
 
-            # HTML coverage report
-            if args.coverage_html:
-                cov.html_report(directory=args.coverage_html, ignore_errors=True)
 
-            # XML coverage report
-            if args.coverage_xml:
-                cov.xml_report(outfile=args.coverage_xml, ignore_errors=True)
+# Report the test run summary - used by unittest-parallel and unittest-parallel-merge
+def _test_summary(tests_run, test_duration, error_count, failure_count, skipped, expected_failures, unexpected_successes, notes=()):
+    # Compute test info
+    infos = []
+    if failure_count:
+        infos.append(f'failures={failure_count}')
+    if error_count:
+        infos.append(f'errors={error_count}')
+    if skipped:
+        infos.append(f'skipped={skipped}')
+    if expected_failures:
+        infos.append(f'expected failures={expected_failures}')
+    if unexpected_successes:
+        infos.append(f'unexpected successes={unexpected_successes}')
 
-            # Fail under
-            if args.coverage_fail_under and percent_covered < args.coverage_fail_under:
-                parser.exit(status=2)
+    # Test report
+    is_success = not(error_count or failure_count or unexpected_successes)
+    print(unittest.TextTestResult.separator2, file=sys.stderr)
+    print(f'Ran {tests_run} {"tests" if tests_run > 1 else "test"} in {test_duration:.3f}s', file=sys.stderr)
+    for note in notes:
+        print(note, file=sys.stderr)
+    print(file=sys.stderr)
+    print(f'{"OK" if is_success else "FAILED"}{" (" + ", ".join(infos) + ")" if infos else ""}', file=sys.stderr)
+
+
+# Add the coverage report arguments - used by unittest-parallel and unittest-parallel-merge
+def _add_coverage_report_arguments(group_coverage):
+    group_coverage.add_argument('--coverage-html', metavar='DIR',
+                                help='Generate coverage HTML report')
+    group_coverage.add_argument('--coverage-xml', metavar='FILE',
+                                help='Generate coverage XML report')
+    group_coverage.add_argument('--coverage-fail-under', metavar='MIN', type=float,
+                                help='Fail if coverage percentage under min')
+
+
+# Report coverage - used by unittest-parallel and unittest-parallel-merge
+def _coverage_report(args, parser, cov):
+    # Coverage report
+    print(file=sys.stderr)
+    percent_covered = cov.report(ignore_errors=True, file=sys.stderr)
+    print(f'Total coverage is {percent_covered:.2f}%', file=sys.stderr)
+
+    # HTML coverage report
+    if args.coverage_html:
+        cov.html_report(directory=args.coverage_html, ignore_errors=True)
+
+    # XML coverage report
+    if args.coverage_xml:
+        cov.xml_report(outfile=args.coverage_xml, ignore_errors=True)
+
+    # Fail under
+    if args.coverage_fail_under and percent_covered < args.coverage_fail_under:
+        parser.exit(status=2)
 
 
 def _convert_select_pattern(pattern):
@@ -224,21 +602,8 @@ def _convert_select_pattern(pattern):
 def _coverage(args, temp_dir):
     # Running tests with coverage?
     if args.coverage:
-        # Generate a random coverage data file name - file is deleted along with containing directory
-        with tempfile.NamedTemporaryFile(dir=temp_dir, delete=False) as coverage_file:
-            pass
-
         # Create the coverage object
-        cov_options = {
-            'branch': args.coverage_branch,
-            'data_file': coverage_file.name,
-            'include': args.coverage_include,
-            'omit': (args.coverage_omit if args.coverage_omit else []) + [__file__],
-            'source': args.coverage_source
-        }
-        if args.coverage_rcfile is not None:
-            cov_options['config_file'] = args.coverage_rcfile
-        cov = coverage.Coverage(**cov_options)
+        cov = _create_coverage(args, temp_dir)
         try:
             # Start measuring code coverage
             cov.start()
@@ -256,6 +621,1196 @@ def _coverage(args, temp_dir):
         yield None
 
 
+# Yield the test process's coverage object when measuring coverage for the lifetime of the test process
+@contextmanager
+def _worker_coverage():
+    yield _WORKER_STATE.get('coverage')
+
+
+# Run the test tasks in a multiprocessing pool - yields test suite results as they complete
+def _pool_tests(args, temp_dir, process_count, discover_suite, test_ids, test_tasks, chunksize):
+    multiprocessing_context = _multiprocessing_context(args, discover_suite)
+    maxtasksperchild = 1 if args.disable_process_pooling else args.max_tasks_per_worker
+    failfast = multiprocessing_context.RawValue('b', 0)
+    worker_count = multiprocessing_context.Value('i', 0)
+    pool_args = {
+        'maxtasksperchild': maxtasksperchild,
+        'initializer': _init_worker,
+        'initargs': (args, temp_dir, test_ids, failfast, worker_count)
+    }
+    with multiprocessing_context.Pool(process_count, **pool_args) as pool:
+        test_manager = ParallelTestManager(args, temp_dir)
+        yield from pool.imap_unordered(test_manager.run_tests, test_tasks, chunksize=chunksize)
+
+        # Wait for the test processes to exit (test process finalizers save per-process coverage data)
+        pool.close()
+        pool.join()
+
+
+# Run the test tasks on threads in this process - yields test suite results as they complete. This process is
+# initialized as the only test process, so coverage is measured once for all threads (--coverage-per-process).
+# sys.stdout and sys.stderr are replaced with thread-local streams so that each thread's test output is buffered
+# separately (--buffer). Unless warnings are context-aware (Python 3.14+), warnings.catch_warnings is replaced so that
+# the threads' warnings contexts (e.g., assertWarns) don't overwrite each other's process-global warnings state.
+def _thread_tests(args, temp_dir, thread_count, test_ids, test_tasks):
+    _init_worker(args, temp_dir, test_ids, multiprocessing.RawValue('b', 0), multiprocessing.Value('i', 0))
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _ThreadLocalStream(stdout), _ThreadLocalStream(stderr)
+    catch_warnings = warnings.catch_warnings
+    if not getattr(sys.flags, 'context_aware_warnings', False):
+        warnings.catch_warnings = _ThreadCatchWarnings
+    try:
+        with catch_warnings(), multiprocessing.pool.ThreadPool(thread_count) as pool:
+            test_manager = ParallelTestManager(args, temp_dir)
+            yield from pool.imap_unordered(test_manager.run_tests, test_tasks)
+    finally:
+        warnings.catch_warnings = catch_warnings
+        sys.stdout, sys.stderr = stdout, stderr
+        _exit_worker()
+
+
+# A thread-local stream - writes to the current thread's stream or, if not set, the default stream
+class _ThreadLocalStream:
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        thread_stream = getattr(self.local, 'stream', None)
+        return getattr(thread_stream if thread_stream is not None else self.stream, name)
+
+
+# A warnings context for test threads - the warnings filters and showwarning function are process-global, so the test
+# threads' warnings contexts are run one at a time. The unittest runner's warnings context is skipped so that test suites
+# can run concurrently (the runner's warnings state is restored once, after all test threads complete).
+class _ThreadCatchWarnings(warnings.catch_warnings):
+
+    lock = threading.RLock()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_runner = sys._getframe(1).f_code is unittest.TextTestRunner.run.__code__ # pylint: disable=protected-access
+
+    def __enter__(self):
+        if self.is_runner:
+            return None
+        self.lock.acquire()
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        if self.is_runner:
+            return None
+        try:
+            return super().__exit__(*exc_info)
+        finally:
+            self.lock.release()
+
+
+# Get the test process multiprocessing context
+def _multiprocessing_context(args, discover_suite):
+    multiprocessing_context = multiprocessing.get_context(method=args.start_method)
+    if args.start_method == 'forkserver':
+        # Preload modules in the fork server so test processes don't re-import them
+        if args.preload:
+            preload_modules = args.preload
+        else:
+            preload_modules = sorted({_test_module_name(test_case) for test_case in _iter_test_cases(discover_suite)})
+        multiprocessing_context.set_forkserver_preload(preload_modules)
+    return multiprocessing_context
+
+
+# Run the test tasks in supervised test processes - yields test suite results as they complete. Each test process has its
+# own connection and runs one test task at a time. Test processes that exceed the memory (or test suite count) limit
+# exit after sending their result and are replaced. Test processes that exit unexpectedly or time out are replaced and
+# their test suite is reported as an error. Test suites not started before the total timeout are reported as errors.
+def _supervised_tests(args, temp_dir, process_count, discover_suite, test_ids, test_tasks, suite_keys):
+    multiprocessing_context = _multiprocessing_context(args, discover_suite)
+    failfast = multiprocessing_context.RawValue('b', 0)
+    worker_count = multiprocessing_context.Value('i', 0)
+    task_indexes = list(reversed(range(len(test_tasks))))
+    workers = {}
+    start_time = time.perf_counter()
+    with tempfile.TemporaryDirectory() as dump_dir:
+
+        # Start a test process
+        def start_worker():
+            connection, worker_connection = multiprocessing_context.Pipe()
+            dump_path = os.path.join(dump_dir, f'worker-{len(os.listdir(dump_dir))}.txt')
+            with open(dump_path, 'w', encoding='utf-8'):
+                pass
+            process = multiprocessing_context.Process(
+                target=_supervised_worker,
+                args=(worker_connection, args, temp_dir, test_ids, failfast, worker_count, dump_path),
+                daemon=True
+            )
+            process.start()
+            worker_connection.close()
+            workers[connection] = [process, None, None, dump_path]
+            return connection
+
+        # Are there more test tasks to run?
+        def has_tasks():
+            return task_indexes and (args.total_timeout is None or time.perf_counter() - start_time < args.total_timeout)
+
+        # Send a test process its next test task and stack dump timeout - returns False if there are no more test tasks
+        def send_task(connection):
+            now = time.perf_counter()
+            task_index = task_indexes.pop() if has_tasks() else None
+            dump_timeouts = []
+            if args.timeout is not None:
+                dump_timeouts.append(args.timeout)
+            if args.total_timeout is not None:
+                dump_timeouts.append(start_time + args.total_timeout - now)
+            try:
+                connection.send((test_tasks[task_index], min(dump_timeouts, default=None)) if task_index is not None else None)
+            except OSError:
+                # The test process exited - its test task is reported when its connection is closed
+                pass
+            workers[connection][1:3] = [task_index, now]
+            return task_index is not None
+
+        # Start a test process to replace another, if there are more test tasks
+        def replace_worker():
+            if has_tasks():
+                connection = start_worker()
+                if not send_task(connection):
+                    stop_worker(connection)
+
+        # Stop a test process
+        def stop_worker(connection, is_kill=False):
+            process = workers.pop(connection)[0]
+            connection.close()
+            if is_kill:
+                process.kill()
+            process.join()
+
+        for _ in range(min(process_count, len(test_tasks))):
+            connection = start_worker()
+            if not send_task(connection):
+                stop_worker(connection)
+        while workers:
+            # Wait for test suite results until the next timeout
+            deadlines = []
+            if args.timeout is not None:
+                deadlines.extend(worker[2] + args.timeout for worker in workers.values())
+            if args.total_timeout is not None:
+                deadlines.append(start_time + args.total_timeout)
+            wait_timeout = max(0, min(deadlines) - time.perf_counter()) if deadlines else None
+            for connection in multiprocessing.connection.wait(list(workers), timeout=wait_timeout):
+                process, task_index, task_time, _ = workers[connection]
+                try:
+                    result, is_exiting = connection.recv()
+                except (EOFError, OSError):
+                    process.join()
+                    result = None
+                    if task_index is not None:
+                        result = _error_result(
+                            suite_keys[task_index],
+                            f'Test process exited unexpectedly (exit code {process.exitcode})',
+                            time.perf_counter() - task_time
+                        )
+                    is_exiting = True
+                if result is not None:
+                    yield result
+
+                # Send the test process its next test task, or replace it if it's exiting
+                if is_exiting:
+                    stop_worker(connection)
+                    replace_worker()
+                elif not send_task(connection):
+                    stop_worker(connection)
+
+            # Kill and replace timed out test processes - the test process's stack is reported with the test suite error
+            now = time.perf_counter()
+            is_total_timeout = args.total_timeout is not None and now - start_time >= args.total_timeout
+            for connection, (_, task_index, task_time, dump_path) in list(workers.items()):
+                if task_index is None:
+                    continue
+                if is_total_timeout:
+                    message = f'Test run timed out after {args.total_timeout:g} seconds'
+                elif args.timeout is not None and now - task_time >= args.timeout:
+                    message = f'Test suite timed out after {args.timeout:g} seconds'
+                else:
+                    continue
+                timeout_stack = _read_timeout_dump(dump_path)
+                stop_worker(connection, is_kill=True)
+                yield _error_result(
+                    suite_keys[task_index],
+                    f'{message}\n\n{timeout_stack.rstrip()}' if timeout_stack else message,
+                    now - task_time
+                )
+                if not is_total_timeout:
+                    replace_worker()
+
+        # Report the test suites that were not started before the total timeout as errors
+        for task_index in reversed(task_indexes):
+            yield _error_result(
+                suite_keys[task_index],
+                f'Test suite not run - test run timed out after {args.total_timeout:g} seconds',
+                0
+            )
+
+
+# Read a test process's faulthandler timeout stack dump - the test process dumps its stack when the test suite times out,
+# so wait briefly for the dump
+def _read_timeout_dump(dump_path):
+    dump_time = time.perf_counter()
+    while True:
+        with open(dump_path, encoding='utf-8', errors='replace') as dump_file:
+            dump = dump_file.read()
+        if dump or time.perf_counter() - dump_time >= TIMEOUT_DUMP_WAIT:
+            return dump
+        time.sleep(0.05)
+
+
+# A supervised test process - runs test tasks until there are no more or until it exceeds the memory (or test suite count)
+# limit. The test process's stack is dumped to dump_path if a test suite times out.
+def _supervised_worker(connection, args, temp_dir, test_ids, failfast, worker_count, dump_path):
+    _init_worker(args, temp_dir, test_ids, failfast, worker_count)
+    test_manager = ParallelTestManager(args, temp_dir)
+    task_count = 0
+    with connection, open(dump_path, 'w', encoding='utf-8') as dump_file:
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            test_task, dump_timeout = message
+            if dump_timeout is not None:
+                faulthandler.dump_traceback_later(max(dump_timeout, 0.001), file=dump_file)
+            result = test_manager.run_tests(test_task)
+            if dump_timeout is not None:
+                faulthandler.cancel_dump_traceback_later()
+            task_count += 1
+            is_exiting = args.disable_process_pooling or \
+                (args.max_tasks_per_worker is not None and task_count >= args.max_tasks_per_worker) or \
+                (args.max_worker_memory is not None and _worker_memory() > args.max_worker_memory)
+            connection.send((result, is_exiting))
+            if is_exiting:
+                break
+
+
+# Get the test process's memory (resident set size) in megabytes - returns 0 if unavailable (e.g., on Windows). On Linux,
+# the current resident set size is used since a spawned process's peak resident set size includes its parent's peak.
+# Elsewhere, the peak resident set size is used.
+def _worker_memory():
+    try:
+        with open('/proc/self/statm', encoding='utf-8') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError: # pragma: no cover
+        pass
+    try:
+        import resource # pylint: disable=import-outside-toplevel
+    except ImportError: # pragma: no cover
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+
+# Create a test suite error result (e.g., for a test process that exited unexpectedly) - the test suite is recorded as
+# an errored test so that it is included in the test reports
+def _error_result(suite_key, message, duration):
+    error = '\n'.join([
+        unittest.TextTestResult.separator1,
+        f'ERROR: {suite_key}',
+        unittest.TextTestResult.separator2,
+        f'{message}\n'
+    ])
+    test_records = [(suite_key, time.time() - duration, duration, 'error', f'{message}\n')]
+    return SuiteResult(
+        test_count=0, errors=[error], failures=[], skipped=0, expected_failures=0, unexpected_successes=0, duration=None,
+        suite_key=suite_key, coverage_file=None, test_records=test_records, pid=None, thread_id=None,
+        failed_test_ids=suite_key.split(',')
+    )
+
+
+# Serve the test tasks to --worker processes - yields test suite results as they complete. Each --worker test process
+# connection is handled by a thread that sends one test task at a time. The test tasks of lost connections are re-queued.
+def _serve_tests(args, temp_dir, test_ids, test_tasks):
+    task_queue = queue.Queue()
+    for test_task in test_tasks:
+        task_queue.put(test_task)
+    result_queue = queue.Queue()
+    closed = threading.Event()
+    with multiprocessing.connection.Listener(_parse_address(args.serve), authkey=_authkey()) as listener:
+        print(f'Serving at {_format_address(listener.address)}', file=sys.stderr)
+        accept_args = (listener, closed, args, test_ids, task_queue, result_queue)
+        threading.Thread(target=_serve_accept, args=accept_args, daemon=True).start()
+
+        # Yield the test suite results - cancelled test tasks have a None result
+        result_count = len(test_tasks)
+        while result_count:
+            result = result_queue.get()
+            result_count -= 1
+            if result is None:
+                continue
+
+            # Write the test suite's coverage data to a local coverage data file
+            if result.coverage_file is not None:
+                with tempfile.NamedTemporaryFile(dir=temp_dir, prefix='.coverage.', delete=False) as coverage_file:
+                    coverage_file.write(result.coverage_file)
+                result = result._replace(coverage_file=coverage_file.name)
+
+            yield result
+
+        # Tell the --worker test processes to exit
+        task_queue.put(None)
+        closed.set()
+
+
+# Accept --worker test process connections
+def _serve_accept(listener, closed, args, test_ids, task_queue, result_queue):
+    while True:
+        try:
+            connection = listener.accept()
+        except (EOFError, OSError, multiprocessing.AuthenticationError):
+            if closed.is_set():
+                break
+            continue
+        threading.Thread(target=_serve_connection, args=(connection, args, test_ids, task_queue, result_queue), daemon=True).start()
+
+
+# Send test tasks to a --worker test process connection, one at a time - a None test task tells the test process to exit
+def _serve_connection(connection, args, test_ids, task_queue, result_queue):
+    with connection:
+        try:
+            connection.send((args, test_ids))
+        except OSError:
+            return
+        while True:
+            test_task = task_queue.get()
+            if test_task is None:
+                task_queue.put(None)
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+                break
+            try:
+                connection.send(test_task)
+                result = connection.recv()
+            except (EOFError, OSError):
+                task_queue.put(test_task)
+                break
+
+            # Fail fast? Cancel the remaining test tasks.
+            if args.failfast and (result.errors or result.failures):
+                while True:
+                    try:
+                        task_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    result_queue.put(None)
+            result_queue.put(result)
+
+
+# Run the test suites served by a --serve process using process_count test processes
+def _run_worker(args, process_count):
+    multiprocessing_context = multiprocessing.get_context(method=args.start_method)
+    worker_count = multiprocessing_context.Value('i', 0)
+    processes = [
+        multiprocessing_context.Process(target=_worker_client, args=(_parse_address(args.worker), _authkey(), worker_count))
+        for _ in range(process_count)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+# A --worker test process - receives test tasks from the --serve process and sends back the test suite results
+def _worker_client(address, authkey, worker_count):
+    # Connect to the --serve process (it may not be listening yet)
+    connect_time = time.perf_counter()
+    while True:
+        try:
+            connection = multiprocessing.connection.Client(address, authkey=authkey)
+            break
+        except (ConnectionRefusedError, FileNotFoundError):
+            if time.perf_counter() - connect_time >= WORKER_CONNECT_TIMEOUT:
+                raise
+            time.sleep(0.1)
+
+    with connection, tempfile.TemporaryDirectory() as temp_dir:
+        # Initialize the test process using the --serve process's arguments
+        try:
+            args, test_ids = connection.recv()
+        except EOFError:
+            return
+        _add_top_level_dir(args)
+        _init_worker(args, temp_dir, test_ids, multiprocessing.RawValue('b', 0), worker_count)
+        test_manager = ParallelTestManager(args, temp_dir)
+
+        # Run test tasks until there are no more
+        while True:
+            try:
+                test_task = connection.recv()
+            except EOFError:
+                break
+            if test_task is None:
+                break
+            result = test_manager.run_tests(test_task)
+
+            # Send the test suite's coverage data rather than its coverage data file name
+            if result.coverage_file is not None:
+                with open(result.coverage_file, 'rb') as coverage_file:
+                    result = result._replace(coverage_file=coverage_file.read())
+                os.remove(coverage_file.name)
+
+            connection.send(result)
+        _exit_worker()
+
+
+# Parse a --serve/--worker address - HOST:PORT or a UNIX socket path
+def _parse_address(address):
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return (host, int(port))
+    return address
+
+
+# Format a --serve/--worker address
+def _format_address(address):
+    if isinstance(address, tuple):
+        return f'{address[0]}:{address[1]}'
+    return address
+
+
+# Get the --serve/--worker authentication key
+def _authkey():
+    return os.environ['UNITTEST_PARALLEL_AUTHKEY'].encode('utf-8')
+
+
+# Discover tests - returns the discovered test suite, the discovery coverage data file, and True if the tests must be sent
+# to the test processes by test ID (tests loaded from the discovery cache or discovered in parallel)
+def _discover_tests(args, temp_dir, process_count):
+    # Load the tests from the discovery cache if the test files are unchanged - test modules are not imported
+    if args.cache_discovery:
+        discovery_key = _discovery_key(args)
+        discovery_cache = _load_cache(args, 'discovery')
+        if discovery_cache.get('key') == discovery_key:
+            _add_top_level_dir(args)
+            return _discovery_cache_suite(discovery_cache['tests']), None, True
+
+    # Discover tests in parallel?
+    if args.parallel_discovery:
+        discovery_tests = _parallel_discover(args, process_count)
+        if discovery_tests is not None:
+            if args.cache_discovery:
+                _save_cache(args, 'discovery', {'key': discovery_key, 'tests': discovery_tests})
+            return _discovery_cache_suite(discovery_tests), None, True
+
+    # Discover tests
+    with _coverage(args, temp_dir) as cov:
+        test_loader = unittest.TestLoader()
+        if args.testNamePatterns:
+            test_loader.testNamePatterns = args.testNamePatterns
+        discover_suite = test_loader.discover(args.start_directory, pattern=args.pattern, top_level_dir=args.top_level_directory)
+
+    # Save the discovery cache (unless a test can't be loaded by name)
+    if args.cache_discovery:
+        discovery_tests = _discovery_cache_tests(discover_suite)
+        if discovery_tests is not None:
+            _save_cache(args, 'discovery', {'key': discovery_key, 'tests': discovery_tests})
+
+    return discover_suite, cov.config.data_file if cov is not None else None, False
+
+
+# Add the top-level directory to the module search path (as TestLoader.discover does)
+def _add_top_level_dir(args):
+    top_level_dir = os.path.abspath(args.top_level_directory or args.start_directory)
+    if top_level_dir not in sys.path:
+        sys.path.insert(0, top_level_dir)
+    return top_level_dir
+
+
+# Discover tests in parallel - the test modules are imported and loaded in the test processes. Returns the discovery cache
+# test tree or None if the tests must be discovered serially (a package load_tests function, a test module import error,
+# or tests that can't be loaded by name).
+def _parallel_discover(args, process_count):
+    top_level_dir = _add_top_level_dir(args)
+    module_names = list(_find_test_modules(os.path.abspath(args.start_directory), top_level_dir, args.pattern))
+    if None in module_names:
+        return None
+
+    # Load the test modules in parallel
+    multiprocessing_context = multiprocessing.get_context(method=args.start_method)
+    with multiprocessing_context.Pool(max(1, min(len(module_names), process_count))) as pool:
+        module_tests = pool.starmap(
+            _discover_module,
+            [(module_name, args.pattern, args.testNamePatterns) for module_name in module_names],
+            chunksize=1
+        )
+    if None in module_tests:
+        return None
+    return [module_test for module_test_list in module_tests for module_test in module_test_list]
+
+
+# Find the test module names in a directory (in TestLoader.discover order) - yields None for packages with a load_tests
+# function, which must be discovered serially
+def _find_test_modules(dir_path, top_level_dir, pattern):
+    for name in sorted(os.listdir(dir_path)):
+        path = os.path.join(dir_path, name)
+        if os.path.isfile(path):
+            if RE_MODULE_FILE_NAME.match(name) and fnmatch.fnmatch(name, pattern):
+                module_path = os.path.relpath(os.path.splitext(path)[0], top_level_dir)
+                yield module_path.replace(os.sep, '.') if not module_path.startswith('..') else None
+        elif os.path.isfile(os.path.join(path, '__init__.py')):
+            with open(os.path.join(path, '__init__.py'), encoding='utf-8') as init_file:
+                if 'load_tests' in init_file.read():
+                    yield None
+            yield from _find_test_modules(path, top_level_dir, pattern)
+
+
+# Import and load a test module's tests in a test process - returns the test module's discovery cache test tree or None
+def _discover_module(module_name, pattern, test_name_patterns):
+    test_loader = unittest.TestLoader()
+    if test_name_patterns:
+        test_loader.testNamePatterns = test_name_patterns
+    try:
+        module = importlib.import_module(module_name)
+    except Exception: # pylint: disable=broad-exception-caught
+        return None
+    module_suite = test_loader.loadTestsFromModule(module, pattern=pattern)
+    if test_loader.errors:
+        return None
+    return _discovery_cache_tests(unittest.TestSuite([module_suite]))
+
+
+# Get the discovery cache key - the discovery arguments and the modification time and size of each Python file in the
+# start directory's packages
+def _discovery_key(args):
+    file_stats = {}
+    for dir_path, dir_names, file_names in os.walk(args.start_directory):
+        dir_names[:] = sorted(
+            dir_name for dir_name in dir_names if os.path.isfile(os.path.join(dir_path, dir_name, '__init__.py'))
+        )
+        for file_name in sorted(file_names):
+            if file_name.endswith('.py'):
+                file_path = os.path.join(dir_path, file_name)
+                file_stat = os.stat(file_path)
+                file_stats[os.path.relpath(file_path, args.start_directory)] = [file_stat.st_mtime_ns, file_stat.st_size]
+    return {
+        'start_directory': os.path.abspath(args.start_directory),
+        'pattern': args.pattern,
+        'top_level_directory': os.path.abspath(args.top_level_directory) if args.top_level_directory is not None else None,
+        'testNamePatterns': args.testNamePatterns,
+        'files': file_stats
+    }
+
+
+# Get the discovery cache's test tree - [[module_name, [[class_name, [method_name, ...]], ...]], ...] - returns None if a
+# test can't be loaded by name
+def _discovery_cache_tests(discover_suite):
+    discovery_tests = []
+    for module_suite in _iter_module_suites(discover_suite):
+        module_classes = []
+        for class_suite in _iter_class_suites(module_suite):
+            test_cases = list(_iter_test_cases(class_suite))
+            test_classes = {type(test_case) for test_case in test_cases}
+            if len(test_classes) != 1 or not all(_is_loadable_test(test_case) for test_case in test_cases):
+                return None
+            module_classes.append((
+                test_classes.pop(),
+                [test_case._testMethodName for test_case in test_cases] # pylint: disable=protected-access
+            ))
+        module_names = {test_class.__module__ for test_class, _ in module_classes}
+        if len(module_names) != 1:
+            return None
+        discovery_tests.append([
+            module_names.pop(),
+            [[test_class.__qualname__, method_names] for test_class, method_names in module_classes]
+        ])
+    return discovery_tests
+
+
+# Create the test suite from the discovery cache's test tree
+def _discovery_cache_suite(discovery_tests):
+    return unittest.TestSuite(
+        unittest.TestSuite(
+            unittest.TestSuite(
+                _CachedTestCase(f'{module_name}.{class_name}.{method_name}', module_name) for method_name in method_names
+            )
+            for class_name, method_names in module_classes
+        )
+        for module_name, module_classes in discovery_tests
+    )
+
+
+# A test loaded from the discovery cache - cached tests are always sent to the test processes by test ID
+class _CachedTestCase(unittest.TestCase):
+
+    def __init__(self, test_id, module_name):
+        super().__init__()
+        self.test_id = test_id
+        self.module_name = module_name
+
+    def id(self):
+        return self.test_id
+
+    def runTest(self): # pragma: no cover
+        pass
+
+
+# Get a test case's module name
+def _test_module_name(test_case):
+    if isinstance(test_case, _CachedTestCase):
+        return test_case.module_name
+    return type(test_case).__module__
+
+
+# Create a coverage object with a random coverage data file name - file is deleted along with containing directory
+def _create_coverage(args, temp_dir):
+    with tempfile.NamedTemporaryFile(dir=temp_dir, delete=False) as coverage_file:
+        pass
+    cov_options = {
+        'branch': args.coverage_branch,
+        'data_file': coverage_file.name,
+        'include': args.coverage_include,
+        'omit': (args.coverage_omit if args.coverage_omit else []) + [__file__],
+        'source': args.coverage_source
+    }
+    if args.coverage_rcfile is not None:
+        cov_options['config_file'] = args.coverage_rcfile
+    return coverage.Coverage(**cov_options)
+
+
+# Save the source files and lines run by each test suite - each test suite's coverage is measured using the test suite
+# key as the coverage context, and a batch's lines are saved for each of its test suites' keys
+def _save_impact(args, cov):
+    suite_lines = {}
+    cov_data = cov.get_data()
+    for file_name in cov_data.measured_files():
+        rel_file_name = os.path.relpath(file_name)
+        for lineno, contexts in cov_data.contexts_by_lineno(file_name).items():
+            for context in contexts:
+                for suite_key in context.split(',') if context else ():
+                    suite_lines.setdefault(suite_key, {}).setdefault(rel_file_name, set()).add(lineno)
+    impact = _load_cache(args, 'impact')
+    for suite_key, file_lines in suite_lines.items():
+        impact[suite_key] = {file_name: sorted(lines) for file_name, lines in file_lines.items()}
+    _save_cache(args, 'impact', impact)
+
+
+# Get the changed files (relative to the current directory) since a git ref or listed in a file
+def _changed_files(ref):
+    if os.path.isfile(ref):
+        with open(ref, encoding='utf-8') as ref_file:
+            file_names = [line.strip() for line in ref_file if line.strip()]
+    else:
+        git_root = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'], text=True).strip()
+        git_diff = subprocess.check_output(['git', 'diff', '--name-only', ref], text=True)
+        file_names = [os.path.join(git_root, line) for line in git_diff.splitlines() if line]
+    return {os.path.relpath(file_name) for file_name in file_names}
+
+
+# Filter test suites to those affected by changed files - a test suite is affected if its impact data (or the impact
+# data of its test class or module) includes a changed file, if its test module changed, or if it has no impact data
+def _affected_suites(test_suites, impact, changed_files):
+    affected_suites = []
+    for test_suite in test_suites:
+        suite_key = _suite_key(test_suite)
+        impact_keys = [impact_key for key in suite_key.split(',') for impact_key in _test_id_keys(key)]
+        suite_files = set()
+        has_impact = False
+        for impact_key in impact_keys:
+            if impact_key in impact:
+                suite_files.update(impact[impact_key])
+                has_impact = True
+        for test_case in _iter_test_cases(test_suite):
+            module_file = getattr(sys.modules.get(_test_module_name(test_case)), '__file__', None)
+            if module_file is not None:
+                suite_files.add(os.path.relpath(module_file))
+        if not has_impact or not suite_files.isdisjoint(changed_files):
+            affected_suites.append(test_suite)
+    return affected_suites
+
+
+# Run the tests, then watch the top-level directory for file changes and rerun the test suites affected by the changed
+# modules. Changed modules and the modules that import them are removed from sys.modules so that they are reloaded by
+# test discovery - unchanged test modules remain imported.
+def _watch_tests(args, parser, process_count):
+    watch_dir = os.path.abspath(args.top_level_directory or args.start_directory)
+    watch_files = _watch_files(watch_dir)
+    module_imports = {}
+    unaffected_modules = None
+    try:
+        while True:
+            try:
+                _run_tests(args, parser, process_count, unaffected_modules)
+            except SystemExit:
+                pass
+
+            # Wait for file changes
+            print(file=sys.stderr)
+            print(f'Watching for file changes in {watch_dir!r}...', file=sys.stderr)
+            changed_files = set()
+            while not changed_files:
+                time.sleep(WATCH_INTERVAL)
+                previous_files = watch_files
+                watch_files = _watch_files(watch_dir)
+                changed_files = {
+                    file_path for file_path in previous_files.keys() | watch_files.keys()
+                    if previous_files.get(file_path) != watch_files.get(file_path)
+                }
+            print(f'Detected {len(changed_files)} changed files', file=sys.stderr)
+            print(file=sys.stderr)
+
+            # Unload the changed modules and the modules that import them
+            file_modules = {
+                os.path.abspath(module.__file__): module_name
+                for module_name, module in list(sys.modules.items()) if getattr(module, '__file__', None)
+            }
+            watch_modules = {
+                file_path: file_modules.get(file_path) or _file_module_name(file_path, watch_dir)
+                for file_path in previous_files.keys() | watch_files.keys()
+            }
+            affected_modules = _import_dependents(
+                {watch_modules[file_path] for file_path in changed_files},
+                {
+                    module_name: _module_imports(file_path, module_name, watch_files.get(file_path), module_imports)
+                    for file_path, module_name in watch_modules.items()
+                }
+            )
+            for module_name in affected_modules:
+                if sys.modules.pop(module_name, None) is not None:
+                    package_name, _, submodule_name = module_name.rpartition('.')
+                    if package_name in sys.modules:
+                        vars(sys.modules[package_name]).pop(submodule_name, None)
+            unaffected_modules = set(watch_modules.values()) - affected_modules
+    except KeyboardInterrupt:
+        pass
+
+
+# Get the modification times of the Python files in the watched directory - only package directories are watched, so
+# virtual environments and build directories are not walked
+def _watch_files(watch_dir):
+    watch_files = {}
+    for dir_path, dir_names, file_names in os.walk(watch_dir):
+        dir_names[:] = [dir_name for dir_name in dir_names if os.path.isfile(os.path.join(dir_path, dir_name, '__init__.py'))]
+        for file_name in file_names:
+            if file_name.endswith('.py'):
+                file_path = os.path.join(dir_path, file_name)
+                try:
+                    watch_files[file_path] = os.stat(file_path).st_mtime_ns
+                except OSError: # pragma: no cover
+                    pass
+    return watch_files
+
+
+# Get a module name from its file path relative to the watched (top-level) directory
+def _file_module_name(file_path, watch_dir):
+    module_name = os.path.splitext(os.path.relpath(file_path, watch_dir))[0].replace(os.sep, '.')
+    return module_name[:-len('.__init__')] if module_name.endswith('.__init__') else module_name
+
+
+# Get the names of the modules (and their packages) imported by a module - the parsed imports are cached by file
+# modification time
+def _module_imports(file_path, module_name, file_time, module_imports):
+    cached_imports = module_imports.get(file_path)
+    if cached_imports is not None and cached_imports[0] == file_time:
+        return cached_imports[1]
+    try:
+        with open(file_path, 'rb') as module_file:
+            module_tree = ast.parse(module_file.read(), file_path)
+    except (OSError, SyntaxError, ValueError):
+        module_tree = ast.Module(body=[], type_ignores=[])
+    package_name = module_name if os.path.basename(file_path) == '__init__.py' else module_name.rpartition('.')[0]
+    import_names = {module_name}
+    for node in ast.walk(module_tree):
+        if isinstance(node, ast.Import):
+            import_names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            from_name = node.module or ''
+            if node.level:
+                package_parts = package_name.split('.')[:len(package_name.split('.')) - node.level + 1]
+                from_name = '.'.join(package_parts + ([node.module] if node.module else []))
+            import_names.add(from_name)
+            import_names.update(f'{from_name}.{alias.name}' for alias in node.names)
+    imports = {import_key for import_name in import_names for import_key in _test_id_keys(import_name)} - {module_name}
+    module_imports[file_path] = (file_time, imports)
+    return imports
+
+
+# Get the changed modules and the modules that import them (directly or indirectly)
+def _import_dependents(changed_modules, module_imports):
+    module_dependents = {}
+    for module_name, imports in module_imports.items():
+        for import_name in imports:
+            module_dependents.setdefault(import_name, set()).add(module_name)
+    dependents = set()
+    pending = list(changed_modules)
+    while pending:
+        module_name = pending.pop()
+        if module_name not in dependents:
+            dependents.add(module_name)
+            pending.extend(module_dependents.get(module_name, ()))
+    return dependents
+
+
+# Get a test ID's keys - the test ID, its test class name, and its test module (and package) names
+def _test_id_keys(test_id):
+    test_keys = [test_id]
+    while '.' in test_keys[-1]:
+        test_keys.append(test_keys[-1].rsplit('.', 1)[0])
+    return test_keys
+
+
+# Did a test suite fail in the last run? A test suite failed if one of its tests (or its test class or module) failed.
+def _is_failed_suite(test_suite, last_failed):
+    return any(
+        test_key in last_failed
+        for test_case in _iter_test_cases(test_suite)
+        for test_key in _test_id_keys(test_case.id())
+    )
+
+
+# Load a JSON cache file from the cache directory - returns an empty dict if there is no cache file
+def _load_cache(args, name):
+    if args.cache_dir is None:
+        return {}
+    try:
+        with open(os.path.join(args.cache_dir, f'{name}.json'), encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+# Save a JSON cache file to the cache directory
+def _save_cache(args, name, data):
+    os.makedirs(args.cache_dir, exist_ok=True)
+    with open(os.path.join(args.cache_dir, f'{name}.json'), 'w', encoding='utf-8') as cache_file:
+        json.dump(data, cache_file, indent=2, sort_keys=True)
+
+
+# Print the slowest tests and test suites, the busy time of each test process, and the process time lost to imbalance
+def _print_durations(count, results, slot_count, test_duration):
+    results = [result for result in results if result.duration is not None]
+    test_durations = sorted(
+        ((test_record[2], test_record[0]) for result in results for test_record in result.test_records or ()),
+        reverse=True
+    )
+    suite_durations = sorted(((result.duration, result.suite_key) for result in results), reverse=True)
+    if count > 0:
+        test_durations = test_durations[:count]
+        suite_durations = suite_durations[:count]
+    print(f'Slowest {len(test_durations)} tests:', file=sys.stderr)
+    for duration, test_id in test_durations:
+        print(f'  {duration:.3f}s {test_id}', file=sys.stderr)
+    print(f'Slowest {len(suite_durations)} test suites:', file=sys.stderr)
+    for duration, suite_key in suite_durations:
+        print(f'  {duration:.3f}s {suite_key}', file=sys.stderr)
+
+    # Test process busy time - test processes that run test suites on threads (--executor thread) report each thread
+    process_busy = {}
+    process_suites = {}
+    for result in results:
+        worker_key = (result.pid, result.thread_id)
+        process_busy[worker_key] = process_busy.get(worker_key, 0) + result.duration
+        process_suites[worker_key] = process_suites.get(worker_key, 0) + 1
+    process_threads = {}
+    for pid, _ in process_busy:
+        process_threads[pid] = process_threads.get(pid, 0) + 1
+    print('Test process busy time:', file=sys.stderr)
+    for (pid, thread_id), busy in sorted(process_busy.items(), key=lambda item: item[1], reverse=True):
+        worker_name = f'process {pid}' if process_threads[pid] == 1 else f'process {pid} thread {thread_id}'
+        print(f'  {busy:.3f}s {worker_name} ({process_suites[pid, thread_id]} test suites)', file=sys.stderr)
+
+    # Process time lost to imbalance - the time the test process slots were not running test suites during the test run.
+    # Test processes may be replaced, so the available time is based on the process slots rather than the test processes.
+    available = slot_count * test_duration
+    lost = max(0, available - sum(process_busy.values()))
+    print(
+        f'Process time lost to imbalance: {lost:.3f}s ({100 * lost / available if available else 0:.1f}%)',
+        file=sys.stderr
+    )
+
+
+# Remove the test process profile stats files from a previous run
+def _remove_worker_profiles(profile_dir):
+    os.makedirs(profile_dir, exist_ok=True)
+    for profile_path in _worker_profiles(profile_dir):
+        os.remove(profile_path)
+
+
+# Get the test process profile stats files
+def _worker_profiles(profile_dir):
+    return sorted(
+        os.path.join(profile_dir, profile_name) for profile_name in os.listdir(profile_dir)
+        if RE_WORKER_PROFILE.match(profile_name)
+    )
+
+
+# Merge the test process profile stats files and print the cumulative time hotspots
+def _merge_profiles(profile_dir):
+    profile_paths = _worker_profiles(profile_dir)
+    if not profile_paths:
+        print('No test process profiles', file=sys.stderr)
+        return
+    stats = pstats.Stats(*profile_paths, stream=sys.stderr)
+    profile_path = os.path.join(profile_dir, 'profile.prof')
+    stats.dump_stats(profile_path)
+    print(f'Merged {len(profile_paths)} test process profiles to {profile_path!r}', file=sys.stderr)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_HOTSPOTS)
+
+
+# Create the test report - the tests are ordered by start time
+def _test_report(results, test_duration):
+    report_tests = []
+    for result in results:
+        for test_id, start, duration, outcome, message in result.test_records or ():
+            report_tests.append({
+                'id': test_id,
+                'suite': result.suite_key,
+                'pid': result.pid,
+                'start': start,
+                'duration': duration,
+                'outcome': outcome,
+                'message': message
+            })
+    report_tests.sort(key=lambda report_test: report_test['start'])
+    return {'duration': test_duration, 'tests': report_tests}
+
+
+# Write the JSON test report
+def _write_report_json(report_path, report):
+    with open(report_path, 'w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+# Write the JUnit XML test report - one testsuite element per test suite
+def _write_junit_xml(report_path, report):
+    suite_tests = {}
+    for report_test in report['tests']:
+        suite_tests.setdefault(report_test['suite'], []).append(report_test)
+    total_counts = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0}
+    testsuites = ET.Element('testsuites', name='unittest-parallel', time=f'{report["duration"]:.3f}')
+    for suite_key, report_tests in suite_tests.items():
+        counts = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0}
+        suite_duration = sum(report_test['duration'] for report_test in report_tests)
+        testsuite = ET.SubElement(testsuites, 'testsuite', name=suite_key, time=f'{suite_duration:.3f}')
+        ET.SubElement(ET.SubElement(testsuite, 'properties'), 'property', name='pid', value=str(report_tests[0]['pid']))
+        for report_test in report_tests:
+            counts['tests'] += 1
+            class_name, _, test_name = report_test['id'].rpartition('.')
+            testcase = ET.SubElement(
+                testsuite, 'testcase', classname=class_name, name=test_name, time=f'{report_test["duration"]:.3f}',
+                timestamp=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(report_test['start']))
+            )
+            outcome = report_test['outcome']
+            if outcome in ('failure', 'unexpected success'):
+                counts['failures'] += 1
+                ET.SubElement(testcase, 'failure', message=outcome).text = report_test['message']
+            elif outcome == 'error':
+                counts['errors'] += 1
+                ET.SubElement(testcase, 'error', message=outcome).text = report_test['message']
+            elif outcome in ('skipped', 'expected failure'):
+                counts['skipped'] += 1
+                ET.SubElement(testcase, 'skipped', message=report_test['message'] or outcome)
+        for count_name, count in counts.items():
+            testsuite.set(count_name, str(count))
+            total_counts[count_name] += count
+    for count_name, count in total_counts.items():
+        testsuites.set(count_name, str(count))
+    ET.indent(testsuites)
+    ET.ElementTree(testsuites).write(report_path, encoding='utf-8', xml_declaration=True)
+
+
+# Get a test suite's key - the test ID, the test class name, or the test module name
+def _suite_key(test_suite):
+    if isinstance(test_suite, _BatchTestSuite):
+        return ','.join(_suite_key(batch_suite) for batch_suite in test_suite)
+    test_ids = [test_case.id() for test_case in _iter_test_cases(test_suite)]
+    if len(test_ids) == 1:
+        return test_ids[0]
+    class_names = sorted({test_id.rsplit('.', 1)[0] for test_id in test_ids})
+    if len(class_names) == 1:
+        return class_names[0]
+    module_names = sorted({_test_module_name(test_case) for test_case in _iter_test_cases(test_suite)})
+    return ','.join(module_names)
+
+
+# Get a test suite's saved duration - the test suite key's duration or the sum of its tests' durations. Returns None if
+# there is no saved duration.
+def _suite_duration(test_suite, suite_durations):
+    duration = suite_durations.get(_suite_key(test_suite))
+    if duration is None:
+        test_durations = [suite_durations.get(test_case.id()) for test_case in _iter_test_cases(test_suite)]
+        if test_durations and None not in test_durations:
+            duration = sum(test_durations)
+    return duration
+
+
+# Estimate test suite costs - the saved duration or, for test suites without a saved duration, the average saved test
+# duration times the test count. If there are no saved durations, the cost is the test count.
+def _suite_costs(test_suites, suite_durations):
+    durations = [_suite_duration(test_suite, suite_durations) for test_suite in test_suites]
+    known_tests = sum(test_suite.countTestCases() for test_suite, duration in zip(test_suites, durations) if duration is not None)
+    known_duration = sum(duration for duration in durations if duration is not None)
+    test_duration = known_duration / known_tests if known_tests else 1
+    return [
+        duration if duration is not None else test_duration * test_suite.countTestCases()
+        for test_suite, duration in zip(test_suites, durations)
+    ]
+
+
+# Get the 'auto' parallelism level test suites - module test suites more expensive than the target cost are split into
+# their class test suites, unless the module has module fixtures (setUpModule/tearDownModule). Class test suites are not
+# split, so class fixtures (setUpClass/tearDownClass) run once.
+def _auto_level_suites(discover_suite, suite_durations, process_count):
+    module_suites = list(_iter_module_suites(discover_suite))
+    module_costs = _suite_costs(module_suites, suite_durations)
+    target_cost = sum(module_costs) / (process_count * AUTO_SUITES_PER_PROCESS)
+    test_suites = []
+    for module_suite, module_cost in zip(module_suites, module_costs):
+        if module_cost > target_cost and not _has_module_fixture(module_suite):
+            test_suites.extend(_iter_class_suites(module_suite))
+        else:
+            test_suites.append(module_suite)
+    return test_suites
+
+
+# Get the 'fixture' parallelism level test suites - test modules with module fixtures and test classes with class fixtures
+# are not split so their fixtures run once. Other tests are run individually.
+def _fixture_level_suites(discover_suite):
+    test_suites = []
+    for module_suite in _iter_module_suites(discover_suite):
+        if _has_module_fixture(module_suite):
+            test_suites.append(module_suite)
+        else:
+            for class_suite in _iter_class_suites(module_suite):
+                if _has_class_fixture(class_suite):
+                    test_suites.append(class_suite)
+                else:
+                    test_suites.extend(_iter_test_cases(class_suite))
+    return test_suites
+
+
+# Batch the 'auto' parallelism level test suites - consecutive test suites are batched up to the target cost
+def _auto_batch_suites(test_suites, suite_durations, process_count):
+    suite_costs = _suite_costs(test_suites, suite_durations)
+    target_cost = sum(suite_costs) / (process_count * AUTO_SUITES_PER_PROCESS)
+    return _batch_suites(test_suites, suite_costs, min_cost=target_cost)
+
+
+# Batch consecutive test suites into one test suite - a batch is complete when it has max_count test suites or its cost
+# is at least min_cost
+def _batch_suites(test_suites, suite_costs, max_count=None, min_cost=None):
+    batches = []
+    batch = []
+    batch_cost = 0
+    for test_suite, suite_cost in zip(test_suites, suite_costs):
+        batch.append(test_suite)
+        batch_cost += suite_cost
+        if (max_count is not None and len(batch) >= max_count) or (min_cost is not None and batch_cost >= min_cost):
+            batches.append(batch)
+            batch = []
+            batch_cost = 0
+    if batch:
+        batches.append(batch)
+    return [batch[0] if len(batch) == 1 else _BatchTestSuite(tests=batch) for batch in batches]
+
+
+# A batch of test suites - a batch's test suite key is its test suites' keys (see _suite_key)
+class _BatchTestSuite(unittest.TestSuite):
+    pass
+
+
+# Does a test suite's test module have module fixtures? Test modules that are not imported are assumed to have module
+# fixtures.
+def _has_module_fixture(test_suite):
+    for module_name in {_test_module_name(test_case) for test_case in _iter_test_cases(test_suite)}:
+        module = sys.modules.get(module_name)
+        if module is None or hasattr(module, 'setUpModule') or hasattr(module, 'tearDownModule'):
+            return True
+    return False
+
+
+# Does a test suite's test class have class fixtures (setUpClass or tearDownClass)?
+def _has_class_fixture(test_suite):
+    for test_class in {type(test_case) for test_case in _iter_test_cases(test_suite)}:
+        for fixture_name in ('setUpClass', 'tearDownClass'):
+            fixture = getattr(test_class, fixture_name, None)
+            if getattr(fixture, '__func__', fixture) is not getattr(unittest.TestCase, fixture_name).__func__:
+                return True
+    return False
+
+
+# Order test suites longest-processing-time-first - suites without a saved duration use the average duration
+def _order_longest_first(test_suites, suite_durations):
+    durations = [_suite_duration(test_suite, suite_durations) for test_suite in test_suites]
+    known_durations = [duration for duration in durations if duration is not None]
+    if not known_durations:
+        return test_suites
+    default_duration = sum(known_durations) / len(known_durations)
+    suite_indexes = sorted(
+        range(len(test_suites)),
+        key=lambda ix: -(durations[ix] if durations[ix] is not None else default_duration)
+    )
+    return [test_suites[ix] for ix in suite_indexes]
+
+
+# Get the test IDs and test tasks for sending test ID ranges to the test processes - each test task is a test ID
+# index range tuple (with the test suite key for batches) or, for test suites that can't be loaded by name, the test suite
+def _test_id_tasks(test_suites):
+    test_ids = []
+    test_tasks = []
+    for test_suite in test_suites:
+        test_cases = list(_iter_test_cases(test_suite))
+        if all(_is_loadable_test(test_case) for test_case in test_cases):
+            test_task = (len(test_ids), len(test_ids) + len(test_cases))
+            if isinstance(test_suite, _BatchTestSuite):
+                test_task += (_suite_key(test_suite),)
+            test_tasks.append(test_task)
+            test_ids.extend(test_case.id() for test_case in test_cases)
+        else:
+            test_tasks.append(test_suite)
+    return test_ids, test_tasks
+
+
+# Can the test case be loaded by name (TestLoader.loadTestsFromName) using its test ID?
+def _is_loadable_test(test_case):
+    if isinstance(test_case, _CachedTestCase):
+        return True
+    test_class = type(test_case)
+    test_module = sys.modules.get(test_class.__module__)
+    test_method_name = test_case._testMethodName # pylint: disable=protected-access
+    return getattr(test_module, test_class.__name__, None) is test_class and \
+        test_case.id() == f'{unittest.util.strclass(test_class)}.{test_method_name}'
+
+
+# Get a shard's test suites - test suites are assigned to the least-loaded shard longest-first using the estimated test
+# suite costs (see _suite_costs). The assignment is the same on every shard.
+def _shard_suites(test_suites, suite_durations, shard_index, shard_count):
+    suite_keys = [_suite_key(test_suite) for test_suite in test_suites]
+    costs = _suite_costs(test_suites, suite_durations)
+    shard_costs = [0] * shard_count
+    shard_suite_indexes = []
+    for suite_index in sorted(range(len(test_suites)), key=lambda ix: (-costs[ix], suite_keys[ix], ix)):
+        suite_shard = min(range(shard_count), key=lambda ix: (shard_costs[ix], ix))
+        shard_costs[suite_shard] += costs[suite_index]
+        if suite_shard == shard_index:
+            shard_suite_indexes.append(suite_index)
+    return [test_suites[ix] for ix in sorted(shard_suite_indexes)]
+
+
+# Compute the static dispatch chunksize - the same as multiprocessing.Pool.map's default chunksize
+def _static_chunksize(suite_count, process_count):
+    chunksize, extra = divmod(suite_count, process_count * 4)
+    if extra:
+        chunksize += 1
+    return max(1, chunksize)
+
+
+# Estimate the total process idle time of dispatching test suites in chunks to the first available process
+def _estimate_idle_time(durations, process_count, chunksize):
+    process_times = [0.] * process_count
+    for ix_chunk in range(0, len(durations), chunksize):
+        ix_process = process_times.index(min(process_times))
+        process_times[ix_process] += sum(durations[ix_chunk:ix_chunk + chunksize])
+    return process_count * max(process_times) - sum(durations)
+
+
 # Iterate module-level test suites - all top-level test suites returned from TestLoader.discover
 def _iter_module_suites(test_suite):
     for module_suite in test_suite:
@@ -282,45 +1837,164 @@ def _iter_test_cases(test_suite):
             yield from _iter_test_cases(suite)
 
 
+# Test process state - set by the test process initializer
+_WORKER_STATE = {}
+
+
+# Test process initializer - the failfast flag is a shared memory value set when a test process fails fast. The worker
+# count is a shared memory value used to number the test processes.
+def _init_worker(args, temp_dir, test_ids, failfast, worker_count):
+    _WORKER_STATE['test_ids'] = test_ids
+    _WORKER_STATE['failfast'] = failfast
+
+    # Set the test process's index environment variable
+    with worker_count.get_lock():
+        worker_index = worker_count.value
+        worker_count.value += 1
+    os.environ['UNITTEST_PARALLEL_WORKER'] = str(worker_index)
+
+    # Measure coverage for the lifetime of the test process?
+    if args.coverage and args.coverage_per_process:
+        cov = _create_coverage(args, temp_dir)
+        cov.start()
+        _WORKER_STATE['coverage'] = cov
+
+    # Profile the test process?
+    if args.profile is not None:
+        _WORKER_STATE['profile'] = (cProfile.Profile(), os.path.join(args.profile, f'worker-{os.getpid()}.prof'))
+
+    # Call the test process init function - if it fails, the test process's test suites are reported as errors (raising
+    # from a pool initializer restarts the test process forever)
+    worker_finalize_func = args.worker_finalize_func
+    if args.worker_init_func is not None:
+        try:
+            args.worker_init_func()
+        except Exception: # pylint: disable=broad-exception-caught
+            _WORKER_STATE['init_error'] = traceback.format_exc()
+            worker_finalize_func = None
+
+    # Finalize the test process when it exits
+    _WORKER_STATE['finalize'] = worker_finalize_func
+    multiprocessing.util.Finalize(None, _exit_worker, exitpriority=0)
+
+
+# Test process finalizer
+def _exit_worker():
+    # Call the test process finalize function
+    worker_finalize_func = _WORKER_STATE.pop('finalize', None)
+    if worker_finalize_func is not None:
+        worker_finalize_func()
+
+    # Stop measuring code coverage and save the test process's coverage data file
+    cov = _WORKER_STATE.pop('coverage', None)
+    if cov is not None:
+        cov.stop()
+        cov.save()
+
+    # Save the test process's profile stats
+    profile = _WORKER_STATE.pop('profile', None)
+    if profile is not None:
+        profile[0].dump_stats(profile[1])
+
+
 class ParallelTestManager:
 
-    def __init__(self, manager, args, temp_dir):
+    def __init__(self, args, temp_dir):
         self.args = args
         self.temp_dir = temp_dir
-        self.failfast = manager.Event()
 
     def run_tests(self, test_suite):
         # Fail fast?
-        if self.failfast.is_set():
-            return [0, [], [], 0, 0, 0]
+        failfast = _WORKER_STATE['failfast']
+        if failfast.value:
+            return SuiteResult(
+                test_count=0, errors=[], failures=[], skipped=0, expected_failures=0, unexpected_successes=0, duration=None,
+                suite_key=None, coverage_file=None, test_records=None, pid=os.getpid(), thread_id=threading.get_native_id(),
+                failed_test_ids=[]
+            )
+
+        # Test process init function failed?
+        init_error = _WORKER_STATE.get('init_error')
+        if init_error is not None:
+            test_suite, suite_key = self._load_test_suite(test_suite)
+            if self.args.failfast:
+                failfast.value = 1
+            return _error_result(suite_key, f'Test process init function failed\n\n{init_error.rstrip()}', 0)
 
         # Run unit tests
-        with _coverage(self.args, self.temp_dir):
-            runner_class = unittest.TextTestRunner if not self.args.runner else self.args.runner_class
-            runner_stream = StringIO() if not self.args.runner and not self.args.result else None
-            result_class = ParallelTextTestResult if not self.args.result else self.args.result_class
-            runner = runner_class(
-                stream=runner_stream,
-                resultclass=result_class,
-                verbosity=self.args.verbose,
-                failfast=self.args.failfast,
-                buffer=self.args.buffer
-            )
-            result = runner.run(test_suite)
-
-            # Set failfast, if necessary
-            if result.shouldStop:
-                self.failfast.set()
-
-            # Return (test_count, errors, failures, skipped_count, expected_failure_count, unexpected_success_count)
-            return (
-                result.testsRun,
-                [self._format_error(result, error) for error in result.errors],
-                [self._format_error(result, failure) for failure in result.failures],
-                len(result.skipped),
-                len(result.expectedFailures),
-                len(result.unexpectedSuccesses)
-            )
+        start_time = time.perf_counter()
+        if self.args.coverage_per_process:
+            suite_coverage = _worker_coverage()
+        else:
+            suite_coverage = _coverage(self.args, self.temp_dir)
+        profile = _WORKER_STATE.get('profile')
+        suite_profile = profile[0] if profile is not None else nullcontext()
+        with suite_coverage as cov:
+            with suite_profile:
+                # Load the test suite and compute its key before running (running a test suite removes its tests)
+                test_suite, suite_key = self._load_test_suite(test_suite)
+
+                # When saving impact data, the test suite key is the coverage context
+                if cov is not None and self.args.cache_dir is not None and self.args.executor != 'thread':
+                    cov.switch_context(suite_key)
+
+                # Run the test suite
+                runner_class = unittest.TextTestRunner if not self.args.runner else self.args.runner_class
+                runner_stream = StringIO() if not self.args.runner and not self.args.result else None
+                result_class = ParallelTextTestResult if not self.args.result else self.args.result_class
+                runner = runner_class(
+                    stream=runner_stream,
+                    resultclass=result_class,
+                    verbosity=self.args.verbose,
+                    failfast=self.args.failfast,
+                    buffer=self.args.buffer
+                )
+                result = runner.run(test_suite)
+
+                # Set failfast, if necessary
+                if result.shouldStop:
+                    failfast.value = 1
+
+        # Return the test suite result
+        is_test_records = self.args.report_json is not None or self.args.junit_xml is not None or self.args.durations is not None or \
+            self.args.level == 'auto'
+        return SuiteResult(
+            test_count=result.testsRun,
+            errors=[self._format_error(result, error) for error in result.errors],
+            failures=[self._format_error(result, failure) for failure in result.failures],
+            skipped=len(result.skipped),
+            expected_failures=len(result.expectedFailures),
+            unexpected_successes=len(result.unexpectedSuccesses),
+            duration=time.perf_counter() - start_time,
+            suite_key=suite_key,
+            coverage_file=cov.config.data_file if cov is not None and not self.args.coverage_per_process else None,
+            test_records=getattr(result, 'test_records', None) if is_test_records else None,
+            pid=os.getpid(),
+            thread_id=threading.get_native_id(),
+            failed_test_ids=self._failed_test_ids(result, suite_key)
+        )
+
+    # Load the test suite from a test ID index range (see _test_id_tasks)? Test modules are imported once per test
+    # process. Returns the test suite and its test suite key.
+    @staticmethod
+    def _load_test_suite(test_task):
+        if not isinstance(test_task, tuple):
+            return test_task, _suite_key(test_task)
+        test_suite = unittest.TestLoader().loadTestsFromNames(_WORKER_STATE['test_ids'][test_task[0]:test_task[1]])
+        suite_key = test_task[2] if len(test_task) > 2 else _suite_key(test_suite)
+        return test_suite, suite_key
+
+    # Get the IDs of the failed tests - subtest failures fail their test, and failures outside of a test (e.g., setUpClass
+    # errors) fail the test suite
+    @staticmethod
+    def _failed_test_ids(result, suite_key):
+        failed_test_ids = set()
+        for test in [error[0] for error in result.errors + result.failures] + list(result.unexpectedSuccesses):
+            if isinstance(test, unittest.TestCase):
+                failed_test_ids.add(getattr(test, 'test_case', test).id())
+            else:
+                failed_test_ids.update(suite_key.split(','))
+        return sorted(failed_test_ids)
 
     @staticmethod
     def _format_error(result, error):
@@ -335,14 +2009,80 @@ class ParallelTestManager:
 class ParallelTextTestResult(unittest.TextTestResult):
 
     def __init__(self, stream, descriptions, verbosity):
-        stream = type(stream)(sys.stderr)
+        stream = type(stream)(sys.stderr.stream if isinstance(sys.stderr, _ThreadLocalStream) else sys.stderr)
         super().__init__(stream, descriptions, verbosity)
 
+        # Test records - (test_id, start_time, duration, outcome, message)
+        self.test_records = []
+        self._test_start = None
+
     def startTest(self, test):
         if self.showAll:
             self.stream.writeln(f'{self.getDescription(test)} ...')
             self.stream.flush()
         super(unittest.TextTestResult, self).startTest(test)
+        self._test_start = [test, time.time(), time.perf_counter(), None, None]
+
+    def stopTest(self, test):
+        super().stopTest(test)
+
+        # Record the test
+        if self._test_start is not None and self._test_start[0] is test:
+            _, start_time, start_counter, outcome, message = self._test_start
+            self.test_records.append((test.id(), start_time, time.perf_counter() - start_counter, outcome or 'success', message))
+            self._test_start = None
+
+        # Stop between tests if another test process failed fast
+        failfast = _WORKER_STATE.get('failfast')
+        if failfast is not None and failfast.value:
+            self.stop()
+
+    # Buffer the test output (--buffer) in the current thread's streams when running tests on threads
+    def _setupStdout(self):
+        if not (self.buffer and isinstance(sys.stdout, _ThreadLocalStream)):
+            super()._setupStdout()
+            return
+        if self._stderr_buffer is None:
+            self._stderr_buffer = StringIO()
+            self._stdout_buffer = StringIO()
+        sys.stdout.local.stream = self._stdout_buffer
+        sys.stderr.local.stream = self._stderr_buffer
+
+    def _restoreStdout(self):
+        if not (self.buffer and isinstance(sys.stdout, _ThreadLocalStream)):
+            super()._restoreStdout()
+            return
+        sys.stdout.local.stream = None
+        sys.stderr.local.stream = None
+        if self._mirrorOutput:
+            for buffer, stream, line_format in (
+                (self._stdout_buffer, sys.stdout, unittest.result.STDOUT_LINE),
+                (self._stderr_buffer, sys.stderr, unittest.result.STDERR_LINE)
+            ):
+                output = buffer.getvalue()
+                if output:
+                    stream.write(line_format % (output if output.endswith('\n') else f'{output}\n'))
+        for buffer in (self._stdout_buffer, self._stderr_buffer):
+            buffer.seek(0)
+            buffer.truncate()
+
+    def stop(self):
+        super().stop()
+
+        # Signal the other test processes to stop
+        failfast = _WORKER_STATE.get('failfast')
+        if failfast is not None:
+            failfast.value = 1
+
+    # Set the current test's outcome - the first unsuccessful outcome is kept. Outcomes of tests that were not started (e.g.,
+    # setUpClass errors) are recorded immediately.
+    def _record_outcome(self, test, outcome, message=None):
+        if self._test_start is not None and self._test_start[0] is test:
+            if self._test_start[3] is None or self._test_start[3] == 'success':
+                self._test_start[3] = outcome
+                self._test_start[4] = message
+        else:
+            self.test_records.append((test.id(), time.time(), 0.0, outcome, message))
 
     def _add_helper(self, test, dots_message, show_all_message):
         if self.showAll:
@@ -353,27 +2093,41 @@ class ParallelTextTestResult(unittest.TextTestResult):
 
     def addSuccess(self, test):
         super(unittest.TextTestResult, self).addSuccess(test)
+        self._record_outcome(test, 'success')
         self._add_helper(test, '.', 'ok')
 
     def addError(self, test, err):
         super(unittest.TextTestResult, self).addError(test, err)
+        self._record_outcome(test, 'error', self.errors[-1][1])
         self._add_helper(test, 'E', 'ERROR')
 
     def addFailure(self, test, err):
         super(unittest.TextTestResult, self).addFailure(test, err)
+        self._record_outcome(test, 'failure', self.failures[-1][1])
         self._add_helper(test, 'F', 'FAIL')
 
     def addSkip(self, test, reason):
         super(unittest.TextTestResult, self).addSkip(test, reason)
+        self._record_outcome(test, 'skipped', reason)
         self._add_helper(test, 's', f'skipped {reason!r}')
 
     def addExpectedFailure(self, test, err):
         super(unittest.TextTestResult, self).addExpectedFailure(test, err)
+        self._record_outcome(test, 'expected failure')
         self._add_helper(test, 'x', 'expected failure')
 
     def addUnexpectedSuccess(self, test):
         super(unittest.TextTestResult, self).addUnexpectedSuccess(test)
+        self._record_outcome(test, 'unexpected success')
         self._add_helper(test, 'u', 'unexpected success')
 
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            if issubclass(err[0], test.failureException):
+                self._record_outcome(test, 'failure', self.failures[-1][1])
+            else:
+                self._record_outcome(test, 'error', self.errors[-1][1])
+
     def printErrors(self):
         pass
@@ -0,0 +1,111 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/unittest-parallel/blob/main/LICENSE
+
+"""
+unittest-parallel-merge command-line script
+"""
+
+import argparse
+import json
+import sys
+import unittest
+
+import coverage
+
+from .main import (
+    _add_coverage_report_arguments, _coverage_report, _load_cache, _save_cache, _test_summary, _write_junit_xml, _write_report_json
+)
+
+
+def main(argv=None):
+    """
+    unittest-parallel-merge command-line script main entry point - merges the JSON test reports and coverage data files of
+    sharded test runs (--shard-index/--shard-count)
+    """
+
+    # Command line arguments
+    argument_parser_args = {'prog': 'unittest-parallel-merge'}
+    if sys.version_info >= (3, 14): # pragma: no cover
+        argument_parser_args['color'] = False
+    parser = argparse.ArgumentParser(**argument_parser_args)
+    parser.add_argument('reports', metavar='REPORT', nargs='+',
+                        help='The shard JSON test reports (--report-json)')
+    parser.add_argument('--report-json', metavar='FILE',
+                        help='Write the merged JSON test report')
+    parser.add_argument('--junit-xml', metavar='FILE',
+                        help='Write the merged JUnit XML test report')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='Save the merged test suite durations to DIR (for balancing later sharded runs)')
+    group_coverage = parser.add_argument_group('coverage options')
+    group_coverage.add_argument('--coverage-data', metavar='FILE', action='append',
+                                help='Combine a shard coverage data file')
+    group_coverage.add_argument('--coverage-rcfile', metavar='RCFILE',
+                                help='Specify coverage configuration file')
+    _add_coverage_report_arguments(group_coverage)
+    args = parser.parse_args(args=argv)
+
+    # Merge the shard test reports - the merged duration is the duration of the longest shard
+    report_tests = []
+    report_duration = 0
+    for report_path in args.reports:
+        with open(report_path, encoding='utf-8') as report_file:
+            shard_report = json.load(report_file)
+        report_tests.extend(shard_report['tests'])
+        report_duration = max(report_duration, shard_report['duration'])
+    report_tests.sort(key=lambda report_test: report_test['start'])
+    report = {'duration': report_duration, 'tests': report_tests}
+    print(f'Merged {len(args.reports)} shard test reports', file=sys.stderr)
+
+    # Write the merged test reports
+    if args.report_json is not None:
+        _write_report_json(args.report_json, report)
+    if args.junit_xml is not None:
+        _write_junit_xml(args.junit_xml, report)
+
+    # Save the merged test suite durations
+    if args.cache_dir is not None:
+        suite_durations = _load_cache(args, 'durations')
+        merged_durations = {}
+        for report_test in report_tests:
+            merged_durations[report_test['suite']] = merged_durations.get(report_test['suite'], 0) + report_test['duration']
+        suite_durations.update(merged_durations)
+        _save_cache(args, 'durations', suite_durations)
+
+    # Count the test outcomes
+    outcome_tests = {}
+    for report_test in report_tests:
+        outcome_tests.setdefault(report_test['outcome'], []).append(report_test)
+    errors = outcome_tests.get('error', [])
+    failures = outcome_tests.get('failure', [])
+    skipped = len(outcome_tests.get('skipped', []))
+    expected_failures = len(outcome_tests.get('expected failure', []))
+    unexpected_successes = len(outcome_tests.get('unexpected success', []))
+    is_success = not(errors or failures or unexpected_successes)
+
+    # Report test errors
+    print(file=sys.stderr)
+    for error_name, error_tests in (('ERROR', errors), ('FAIL', failures)):
+        for error_test in error_tests:
+            print(unittest.TextTestResult.separator1, file=sys.stderr)
+            print(f'{error_name}: {error_test["id"]}', file=sys.stderr)
+            print(unittest.TextTestResult.separator2, file=sys.stderr)
+            print(error_test['message'], file=sys.stderr)
+
+    # Test report
+    _test_summary(len(report_tests), report_duration, len(errors), len(failures), skipped, expected_failures, unexpected_successes)
+
+    # Return an error status on failure
+    if not is_success:
+        parser.exit(status=len(errors) + len(failures) + unexpected_successes)
+
+    # Combine the shard coverage data files
+    if args.coverage_data:
+        cov_options = {}
+        if args.coverage_rcfile is not None:
+            cov_options['config_file'] = args.coverage_rcfile
+        cov = coverage.Coverage(**cov_options)
+        cov.combine(data_paths=args.coverage_data)
+        cov.save()
+
+        # Coverage reports
+        _coverage_report(args, parser, cov)